@@ -52,6 +52,7 @@ Requires: tar
 Requires: p7zip
 Requires: unzip
 Requires: lzop
+Requires: zstd
 Requires: lsof
 Requires: elfutils
 Requires: createrepo_c
@@ -69,7 +70,6 @@ Requires: python3-hawkey
 Requires: mod_ssl
 Requires: sqlite
 Requires: crash >= 5.1.7
-Requires: wget
 Requires: kexec-tools
 Requires: distribution-gpg-keys
 %if (0%{?rhel} && 0%{?rhel} <= 7) || (0%{?fedora} && 0%{?fedora} <= 27)
@@ -79,6 +79,9 @@ Requires(post): /sbin/install-info
 Requires(post): /usr/bin/crontab
 Requires(post): /usr/bin/systemctl
 Recommends: httpd
+# parallel decompression of gzip and bzip2 archives
+Recommends: pigz
+Recommends: lbzip2
 Recommends: logrotate
 Recommends: podman
 
@@ -222,6 +225,10 @@ exit 0
 %{_bindir}/%{name}-task
 %{_bindir}/%{name}-bugzilla-refresh
 %{_bindir}/%{name}-bugzilla-query
+%{_bindir}/%{name}-reindex
+%{_bindir}/%{name}-indexer
+%{_bindir}/%{name}-convert-manifest
+%{_bindir}/%{name}-migrate-savedir
 %{_bindir}/coredump2packages
 %{python3_sitelib}/retrace/
 %{_datadir}/%{name}/
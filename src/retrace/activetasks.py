@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional, Set
+
+from .config import Config
+
+CONFIG = Config()
+
+
+def init_active_tasks_db() -> sqlite3.Connection:
+    # create the database group-writable and world-readable
+    old_umask = os.umask(0o113)
+    con = sqlite3.connect(os.path.join(CONFIG["SaveDir"], CONFIG["ActiveTaskRegistryFile"]), timeout=30)
+    os.umask(old_umask)
+
+    query = con.cursor()
+    query.execute("CREATE TABLE IF NOT EXISTS active_tasks(taskid INTEGER PRIMARY KEY, since INTEGER)")
+    con.commit()
+
+    return con
+
+
+def add_active_task(taskid: int, con: Optional[sqlite3.Connection] = None) -> None:
+    close = False
+    if con is None:
+        con = init_active_tasks_db()
+        close = True
+
+    query = con.cursor()
+    query.execute("INSERT OR IGNORE INTO active_tasks (taskid, since) VALUES (?, ?)",
+                  (taskid, int(time.time())))
+
+    con.commit()
+    if close:
+        con.close()
+
+
+def remove_active_task(taskid: int, con: Optional[sqlite3.Connection] = None) -> None:
+    close = False
+    if con is None:
+        con = init_active_tasks_db()
+        close = True
+
+    query = con.cursor()
+    query.execute("DELETE FROM active_tasks WHERE taskid = ?", (taskid,))
+
+    con.commit()
+    if close:
+        con.close()
+
+
+def count_registered_tasks(con: Optional[sqlite3.Connection] = None) -> int:
+    close = False
+    if con is None:
+        con = init_active_tasks_db()
+        close = True
+
+    query = con.cursor()
+    result = query.execute("SELECT COUNT(*) FROM active_tasks").fetchone()[0]
+
+    if close:
+        con.close()
+
+    return result
+
+
+def replace_active_tasks(taskids: Iterable[int],
+                         con: Optional[sqlite3.Connection] = None) -> Set[int]:
+    """Makes the registry contain exactly the given tasks in a single
+    transaction. Returns the previously registered task IDs."""
+    close = False
+    if con is None:
+        con = init_active_tasks_db()
+        close = True
+
+    now = int(time.time())
+    query = con.cursor()
+    query.execute("BEGIN IMMEDIATE")
+    previous = set(row[0] for row in query.execute("SELECT taskid FROM active_tasks"))
+    query.execute("DELETE FROM active_tasks")
+    query.executemany("INSERT INTO active_tasks (taskid, since) VALUES (?, ?)",
+                      [(taskid, now) for taskid in taskids])
+
+    con.commit()
+    if close:
+        con.close()
+
+    return previous
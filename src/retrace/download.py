@@ -0,0 +1,739 @@
+import base64
+import ftplib
+import hashlib
+import http.client
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from .config import Config
+from .util import ProgressReporter, ftp_close, ftp_init
+
+CONFIG = Config()
+
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+
+# data is stored here until the download is complete
+PART_SUFFIX = ".part"
+# progress of the segments of a download in parallel, see HTTPDownloader
+SEGMENTS_SUFFIX = ".segments"
+# save the progress of a segment at least after this many bytes
+SEGMENTS_SAVE_BYTES = 64 << 20
+
+CONTENT_RANGE_PARSER = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+# sent along with 416 Range Not Satisfiable
+UNSATISFIED_RANGE_PARSER = re.compile(r"^bytes \*/(\d+)$")
+
+# errors worth trying again, resuming from where the download stopped
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException)
+FTP_TRANSIENT_ERRORS = (OSError, EOFError, ftplib.error_temp, ftplib.error_reply, ftplib.error_proto)
+
+
+class DownloadError(Exception):
+    """A download failed in a way that trying again does not help."""
+
+
+class StreamHasher:
+    """Computes the digest of a file while it is being written, possibly out
+    of order. Data written at the current position is hashed right away,
+    data written elsewhere is read back from the file by catch_up() once
+    everything before it is complete."""
+
+    def __init__(self, name: str = "md5") -> None:
+        self.name = name
+        self.position = 0
+        self._hash = hashlib.new(name)
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Starts over, used when the file is rewritten from the beginning."""
+        with self._lock:
+            self.position = 0
+            self._hash = hashlib.new(self.name)
+
+    def feed(self, offset: int, data: bytes) -> None:
+        with self._lock:
+            if offset <= self.position < offset + len(data):
+                self._hash.update(memoryview(data)[self.position - offset:])
+                self.position = offset + len(data)
+
+    def catch_up(self, fd: int, end: int, chunk_size: int = 1 << 20) -> None:
+        """Hashes the file up to end, which must already be written."""
+        while True:
+            # feed() may be called in between, it only takes the lock briefly
+            with self._lock:
+                if self.position >= end:
+                    break
+
+                data = os.pread(fd, min(chunk_size, end - self.position), self.position)
+                if not data:
+                    raise OSError("Unexpected end of file while hashing")
+                self._hash.update(data)
+                self.position += len(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class SegmentedDownloader:
+    """Common part of the downloaders below.
+
+    Data is written into <target>.part and renamed to target once complete.
+    Large files are split into segments fetched in parallel over separate
+    connections, their progress is kept in <target>.segments. An interrupted
+    download continues where it stopped, either in the same call (up to
+    retries times) or when the same target is downloaded again. If hasher
+    is given, the data is hashed as it arrives, see StreamHasher.
+
+    If sink is given (see retrace.unpacker.StreamUnpacker), the data is
+    passed to it in order instead of being stored. The download then uses
+    a single connection and resumes only within the same call.
+
+    A downloader handles one download at a time, use a separate one for
+    every download running in parallel. Subclasses implement _fetch()
+    and _fetch_segment()."""
+
+    transient_errors: Tuple[Type[BaseException], ...] = (OSError,)
+
+    def __init__(self, progress: Optional[ProgressReporter], hasher: Optional[StreamHasher], sink: Any, *,
+                 buffer_size: int, segments: int, min_segment_size: int, retries: int) -> None:
+        self.progress = progress
+        self.hasher = hasher
+        self.sink = sink
+        self.buffer_size = max(1, buffer_size)
+        # the sink needs the data in order
+        self.segments = max(1, segments) if sink is None else 1
+        self.min_segment_size = max(1, min_segment_size)
+        self.retries = retries
+
+        self._lock = threading.Lock()
+        # size of the current download and the part reported to progress
+        self._expected: Optional[int] = None
+        self._reported = 0
+
+    def close(self) -> None:
+        pass
+
+    def _close_thread(self) -> None:
+        """Closes the connections of the calling thread."""
+
+    def __enter__(self) -> "SegmentedDownloader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def download(self, source: str, target: Path) -> None:
+        """Downloads source into target. Raises DownloadError or OSError on failure,
+        the partial data is kept for the next attempt."""
+        part = target.with_name(target.name + PART_SUFFIX)
+        segments = target.with_name(target.name + SEGMENTS_SUFFIX)
+        self._expected = None
+        self._reported = 0
+        if self.hasher is not None:
+            self.hasher.reset()
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    state = None
+                    if self.sink is None:
+                        state = self._load_segments(source, part, segments)
+                    if state is not None:
+                        self._fetch_segments(source, part, segments, state)
+                    else:
+                        self._fetch(source, part, segments)
+                    break
+                except DownloadError:
+                    if self.sink is None and part.is_file() and part.stat().st_size == 0:
+                        part.unlink()
+                    raise
+                except self.transient_errors as ex:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise DownloadError("%s: %s" % (source, ex)) from ex
+
+                    # a kept-alive connection might be broken
+                    self.close()
+                    time.sleep(min(1 << attempt, 10))
+
+            if self.sink is not None:
+                self.sink.close()
+                return
+        except BaseException:
+            # the unpacking thread would wait for more data forever
+            if self.sink is not None:
+                self.sink.abort()
+            raise
+
+        if self.hasher is not None:
+            # whatever has not been hashed on the fly, e.g. segments after the first one
+            fd = os.open(part, os.O_RDONLY)
+            try:
+                self.hasher.catch_up(fd, os.fstat(fd).st_size, self.buffer_size)
+            finally:
+                os.close(fd)
+
+        if segments.is_file():
+            segments.unlink()
+        part.rename(target)
+
+    def _fetch(self, source: str, part: Path, segments: Path) -> None:
+        """Fetches source into part, resuming from its current size if possible.
+        May switch to segments by _create_segments() and _fetch_segments()."""
+        raise NotImplementedError
+
+    def _fetch_segment(self, source: str, fd: int, segment: List[int], segments: Path, state: Dict) -> None:
+        """Fetches the rest of a segment [start, end, done] into fd. Updates done
+        and saves the state at least every SEGMENTS_SAVE_BYTES, see _read_into()."""
+        raise NotImplementedError
+
+    def _expect(self, total: int) -> None:
+        if self.progress is None:
+            return
+
+        if self._expected is None:
+            self.progress.expect(total)
+        elif self._expected != total:
+            self.progress.expect(total - self._expected)
+        self._expected = total
+
+    def _report(self, nbytes: int) -> None:
+        if self.progress is None:
+            return
+
+        with self._lock:
+            self._reported += nbytes
+        self.progress.update(nbytes)
+
+    def _restart_report(self, done: int) -> None:
+        """Sets the reported amount to what is on disk before (re)starting."""
+        self._report(done - self._reported)
+
+    def _get_offset(self, part: Path) -> int:
+        """Returns the amount of data stored by an earlier attempt."""
+        if self.sink is not None:
+            return self.sink.position
+
+        if part.is_file():
+            return part.stat().st_size
+
+        return 0
+
+    def _open_part(self, part: Path, offset: int) -> int:
+        """Opens part for writing at offset, truncates it if offset is 0.
+        Returns -1 when writing to the sink."""
+        fd = -1
+        if self.sink is not None:
+            if offset == 0 and self.sink.position > 0:
+                self.sink.reset()
+        else:
+            flags = os.O_RDWR | os.O_CREAT
+            if offset == 0:
+                flags |= os.O_TRUNC
+            fd = os.open(part, flags, 0o666)
+
+        if self.hasher is not None:
+            if offset == 0:
+                self.hasher.reset()
+            elif fd >= 0:
+                # data from an earlier attempt, the hasher has seen the data sent to the sink
+                self.hasher.catch_up(fd, offset, self.buffer_size)
+
+        return fd
+
+    @staticmethod
+    def _close_part(fd: int) -> None:
+        if fd >= 0:
+            os.close(fd)
+
+    def _discard(self, part: Path) -> None:
+        """Drops the data of an earlier attempt."""
+        if self.sink is not None:
+            self.sink.reset()
+        elif part.is_file():
+            part.unlink()
+
+    def _write_at(self, target_fd: int, offset: int, data: bytes) -> int:
+        """Writes data at offset, returns the offset after it."""
+        start = offset
+        if self.sink is not None:
+            self.sink.write(data)
+            offset += len(data)
+        else:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(target_fd, view, offset)
+                view = view[written:]
+                offset += written
+        if self.hasher is not None:
+            self.hasher.feed(start, data)
+        self._report(len(data))
+
+        return offset
+
+    def _read_into(self, reader, target_fd: int, offset: int, end: Optional[int]) -> int:
+        """Writes data read from reader at offset up to end (or the end of
+        the data) and returns the offset where it stopped."""
+        while end is None or offset < end:
+            size = self.buffer_size
+            if end is not None:
+                size = min(size, end - offset)
+
+            data = reader.read(size)
+            if not data:
+                break
+
+            offset = self._write_at(target_fd, offset, data)
+
+        return offset
+
+    def _read_segment(self, reader, fd: int, segment: List[int], segments: Path, state: Dict) -> None:
+        start, end, done = segment
+        offset = start + done
+        while offset < end:
+            last = min(end, offset + SEGMENTS_SAVE_BYTES)
+            offset = self._read_into(reader, fd, offset, last)
+            segment[2] = offset - start
+            self._save_segments(segments, state)
+            if offset < last:
+                raise ConnectionError("Connection closed after %d of %d bytes of a segment"
+                                      % (offset - start, end - start))
+
+    def _create_segments(self, source: str, part: Path, segments: Path, total: int, count: int) -> Dict:
+        size = -(-total // count)
+        state = {"url": source,
+                 "size": total,
+                 "segments": [[start, min(start + size, total), 0] for start in range(0, total, size)]}
+
+        with open(part, "wb") as part_file:
+            part_file.truncate(total)
+        if self.hasher is not None:
+            self.hasher.reset()
+        self._save_segments(segments, state)
+        return state
+
+    def _load_segments(self, source: str, part: Path, segments: Path) -> Optional[Dict]:
+        """Returns the progress of an interrupted download in parallel
+        or None if there is none for source."""
+        if not segments.is_file():
+            return None
+
+        try:
+            state = json.loads(segments.read_text())
+            valid = state["url"] == source and part.stat().st_size == state["size"]
+        except (OSError, ValueError, KeyError, TypeError):
+            valid = False
+
+        if not valid:
+            segments.unlink()
+            if part.is_file():
+                part.unlink()
+            return None
+
+        self._expect(state["size"])
+        self._restart_report(sum(done for _, _, done in state["segments"]))
+        return state
+
+    def _save_segments(self, segments: Path, state: Dict) -> None:
+        tmp = segments.with_name(segments.name + ".tmp")
+        with self._lock:
+            tmp.write_text(json.dumps(state))
+            tmp.rename(segments)
+
+    def _fetch_segments(self, source: str, part: Path, segments: Path, state: Dict) -> None:
+        pending = [segment for segment in state["segments"] if segment[0] + segment[2] < segment[1]]
+        if not pending:
+            return
+
+        fd = os.open(part, os.O_RDWR)
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = [executor.submit(self._fetch_segment, source, fd, segment, segments, state)
+                           for segment in pending]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+            self._save_segments(segments, state)
+
+    def _hash_segments(self, fd: int, state: Dict) -> None:
+        """Lets the hasher read what has been downloaded up to the first
+        incomplete segment, its data is then hashed as it arrives."""
+        assert self.hasher is not None
+        frontier = state["size"]
+        for start, end, done in state["segments"]:
+            if start + done < end:
+                frontier = start + done
+                break
+
+        self.hasher.catch_up(fd, frontier, self.buffer_size)
+
+
+class HTTPDownloader(SegmentedDownloader):
+    """Downloads files over HTTP(S) without external tools.
+
+    An interrupted download is resumed using a Range request. Files of at
+    least twice HTTPSegmentMinSize served with range support are split into
+    up to HTTPParallelSegments segments. Connections are kept open and reused
+    for further requests to the same server. Other URL schemes understood
+    by urllib, e.g. ftp://, are downloaded without resume.
+
+    Proxies are taken from the http_proxy, https_proxy and no_proxy
+    environment variables like urllib does. HTTPS is tunneled by CONNECT."""
+
+    transient_errors = TRANSIENT_ERRORS
+
+    def __init__(self, progress: Optional[ProgressReporter] = None,
+                 hasher: Optional[StreamHasher] = None, sink: Any = None) -> None:
+        super().__init__(progress, hasher, sink,
+                         buffer_size=CONFIG["HTTPBufferSize"] << 20,
+                         segments=CONFIG["HTTPParallelSegments"],
+                         min_segment_size=CONFIG["HTTPSegmentMinSize"] << 20,
+                         retries=CONFIG["HTTPRetries"])
+        self.timeout = CONFIG["HTTPTimeout"]
+
+        # every thread fetching a segment has its own connections
+        self._local = threading.local()
+        self._connections: List[http.client.HTTPConnection] = []
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def _close_thread(self) -> None:
+        pool = getattr(self._local, "connections", {})
+        for conn in pool.values():
+            conn.close()
+        pool.clear()
+
+    @staticmethod
+    def _get_proxy(parsed: urllib.parse.SplitResult) -> Optional[urllib.parse.SplitResult]:
+        """Returns the proxy to use for the URL, None to connect directly."""
+        proxy = urllib.request.getproxies().get(parsed.scheme)
+        if not proxy or urllib.request.proxy_bypass(parsed.netloc.rpartition("@")[2]):
+            return None
+
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        return urllib.parse.urlsplit(proxy)
+
+    @staticmethod
+    def _get_proxy_headers(proxy: urllib.parse.SplitResult) -> Dict[str, str]:
+        if proxy.username is None:
+            return {}
+
+        credentials = "%s:%s" % (urllib.parse.unquote(proxy.username),
+                                 urllib.parse.unquote(proxy.password or ""))
+        return {"Proxy-Authorization": "Basic %s" % base64.b64encode(credentials.encode("utf-8")).decode("ascii")}
+
+    def _get_connection(self, parsed: urllib.parse.SplitResult,
+                        proxy: Optional[urllib.parse.SplitResult] = None) -> http.client.HTTPConnection:
+        pool: Optional[Dict[Tuple[str, str], http.client.HTTPConnection]] = \
+            getattr(self._local, "connections", None)
+        if pool is None:
+            pool = self._local.connections = {}
+
+        key = (parsed.scheme, parsed.netloc)
+        conn = pool.get(key)
+        if conn is None:
+            host = parsed.hostname or ""
+            conn_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+            if proxy is None:
+                conn = conn_class(host, parsed.port, timeout=self.timeout)
+            else:
+                conn = conn_class(proxy.hostname or "", proxy.port or 80, timeout=self.timeout)
+                if parsed.scheme == "https":
+                    conn.set_tunnel(host, parsed.port, headers=self._get_proxy_headers(proxy))
+            pool[key] = conn
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    def _drop_connection(self, url: str) -> None:
+        """Closes the connection to the server of url, used when a response
+        has not been read completely and the connection can not be reused."""
+        parsed = urllib.parse.urlsplit(url)
+        pool = getattr(self._local, "connections", {})
+        conn = pool.pop((parsed.scheme, parsed.netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Tuple[http.client.HTTPResponse, str]:
+        """Sends a GET request following redirects. Returns the response and
+        the final URL. The caller must read the whole response or drop the connection."""
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlsplit(url)
+            if parsed.scheme not in ["http", "https"]:
+                raise DownloadError("%s: unsupported URL scheme" % url)
+
+            path = parsed.path or "/"
+            if parsed.query:
+                path += "?" + parsed.query
+
+            request_headers = {"User-Agent": "retrace-server",
+                               "Accept-Encoding": "identity"}
+            request_headers.update(headers)
+
+            proxy = self._get_proxy(parsed)
+            if proxy is not None and parsed.scheme == "http":
+                # a plain HTTP proxy gets the absolute URL
+                path = urllib.parse.urlunsplit((parsed.scheme, parsed.netloc.rpartition("@")[2],
+                                                path, "", ""))
+                request_headers.update(self._get_proxy_headers(proxy))
+            if parsed.username is not None:
+                credentials = "%s:%s" % (urllib.parse.unquote(parsed.username),
+                                         urllib.parse.unquote(parsed.password or ""))
+                request_headers["Authorization"] = "Basic %s" \
+                    % base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+            conn = self._get_connection(parsed, proxy)
+            try:
+                conn.request("GET", path, headers=request_headers)
+                response = conn.getresponse()
+            except TRANSIENT_ERRORS:
+                # the server may have closed the kept-alive connection, try a new one
+                self._drop_connection(url)
+                conn = self._get_connection(parsed, proxy)
+                conn.request("GET", path, headers=request_headers)
+                response = conn.getresponse()
+
+            if response.status in REDIRECT_STATUSES:
+                location = response.getheader("Location")
+                response.read()
+                if not location:
+                    raise DownloadError("%s: redirect without a location" % url)
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            if response.status == 416 and "Range" in headers:
+                # the caller decides based on Content-Range
+                response.read()
+                return response, url
+
+            if response.status >= 400:
+                self._drop_connection(url)
+                raise DownloadError("%s: HTTP %d %s" % (url, response.status, response.reason))
+
+            return response, url
+
+        raise DownloadError("%s: too many redirects" % url)
+
+    def _fetch(self, source: str, part: Path, segments: Path) -> None:
+        if urllib.parse.urlsplit(source).scheme not in ["http", "https"]:
+            self._fetch_urllib(source, part)
+            return
+
+        offset = self._get_offset(part)
+
+        headers = {}
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
+
+        response, final_url = self._request(source, headers)
+        if response.status == 416:
+            match = UNSATISFIED_RANGE_PARSER.match(response.getheader("Content-Range", ""))
+            if match and int(match.group(1)) == offset:
+                # complete already, only the rename is missing
+                self._expect(offset)
+                self._restart_report(offset)
+                return
+
+            self._discard(part)
+            self._fetch(source, part, segments)
+            return
+
+        try:
+            total: Optional[int] = None
+            if response.status == 206:
+                match = CONTENT_RANGE_PARSER.match(response.getheader("Content-Range", ""))
+                if not match or int(match.group(1)) != offset:
+                    raise DownloadError("%s: unexpected Content-Range" % source)
+                if match.group(3) != "*":
+                    total = int(match.group(3))
+            else:
+                # no range support, start over
+                offset = 0
+                if response.length is not None:
+                    total = response.length
+            ranges = response.status == 206 or response.getheader("Accept-Ranges", "") == "bytes"
+
+            if total is not None:
+                self._expect(total)
+            self._restart_report(offset)
+
+            count = min(self.segments, (total or 0) // self.min_segment_size)
+            if offset == 0 and ranges and count > 1:
+                assert total is not None
+                self._drop_connection(final_url)
+                state = self._create_segments(source, part, segments, total, count)
+                self._fetch_segments(source, part, segments, state)
+                return
+
+            fd = self._open_part(part, offset)
+            try:
+                end = self._read_into(response, fd, offset, None)
+            finally:
+                self._close_part(fd)
+
+            if total is not None and end != total:
+                raise ConnectionError("Connection closed after %d of %d bytes" % (end, total))
+        except BaseException:
+            self._drop_connection(final_url)
+            raise
+
+    def _fetch_segment(self, source: str, fd: int, segment: List[int], segments: Path, state: Dict) -> None:
+        start, end, done = segment
+        offset = start + done
+        try:
+            response, _ = self._request(source, {"Range": "bytes=%d-%d" % (offset, end - 1)})
+            match = CONTENT_RANGE_PARSER.match(response.getheader("Content-Range", ""))
+            if response.status != 206 or not match or int(match.group(1)) != offset:
+                raise DownloadError("%s: the server stopped supporting ranges" % source)
+
+            self._read_segment(response, fd, segment, segments, state)
+        finally:
+            # the executor thread ends, its connections would not be used again
+            self._close_thread()
+
+        if self.hasher is not None:
+            self._hash_segments(fd, state)
+
+    def _fetch_urllib(self, url: str, part: Path) -> None:
+        """Fetches URL schemes other than HTTP(S), e.g. ftp://, without resume."""
+        self._restart_report(0)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                length = response.getheader("Content-Length")
+                if length is not None and length.isdigit():
+                    self._expect(int(length))
+
+                fd = self._open_part(part, 0)
+                try:
+                    self._read_into(response, fd, 0, None)
+                finally:
+                    self._close_part(fd)
+        except urllib.error.URLError as ex:
+            if isinstance(ex.reason, OSError):
+                raise ex.reason
+            raise DownloadError("%s: %s" % (url, ex.reason)) from ex
+
+
+class FTPDownloader(SegmentedDownloader):
+    """Downloads files from the FTP server set by FTPHost, FTPDir etc.
+
+    An interrupted download is resumed using REST. Files of at least twice
+    FTPSegmentMinSize are split into up to FTPParallelSegments segments,
+    each fetched over its own connection starting at its offset by REST,
+    which helps on links with high latency."""
+
+    transient_errors = FTP_TRANSIENT_ERRORS
+
+    def __init__(self, progress: Optional[ProgressReporter] = None,
+                 hasher: Optional[StreamHasher] = None, sink: Any = None) -> None:
+        super().__init__(progress, hasher, sink,
+                         buffer_size=CONFIG["FTPBufferSize"] << 20,
+                         segments=CONFIG["FTPParallelSegments"],
+                         min_segment_size=CONFIG["FTPSegmentMinSize"] << 20,
+                         retries=CONFIG["FTPRetries"])
+
+    @staticmethod
+    def _supports_rest(ftp: ftplib.FTP) -> bool:
+        try:
+            ftp.sendcmd("REST 0")
+        except ftplib.error_perm:
+            return False
+
+        return True
+
+    def _fetch(self, source: str, part: Path, segments: Path) -> None:
+        ftp = ftp_init()
+        try:
+            ftp.voidcmd("TYPE I")
+            try:
+                size = ftp.size(source)
+            except ftplib.error_perm:
+                size = None
+
+            rest = self._supports_rest(ftp)
+            offset = 0
+            if rest:
+                offset = self._get_offset(part)
+            if size is not None:
+                if offset > size:
+                    offset = 0
+                self._expect(size)
+            self._restart_report(offset)
+
+            count = min(self.segments, (size or 0) // self.min_segment_size)
+            if offset == 0 and rest and count > 1:
+                assert size is not None
+                state = self._create_segments(source, part, segments, size, count)
+                self._fetch_segments(source, part, segments, state)
+                return
+
+            if size is not None and offset == size:
+                # complete already, only the rename is missing
+                return
+
+            fd = self._open_part(part, offset)
+            try:
+                position = offset
+
+                def write_block(data: bytes) -> None:
+                    nonlocal position
+                    position = self._write_at(fd, position, data)
+
+                # the files are expected to be huge (even hundreds of gigabytes)
+                # use a larger buffer - 16MB by default
+                ftp.retrbinary("RETR %s" % source, write_block, self.buffer_size, rest=offset or None)
+            finally:
+                self._close_part(fd)
+
+            if size is not None and position != size:
+                raise ConnectionError("Transfer ended after %d of %d bytes" % (position, size))
+        except ftplib.error_perm as ex:
+            raise DownloadError("%s: %s" % (source, ex)) from ex
+        finally:
+            ftp_close(ftp)
+
+    def _fetch_segment(self, source: str, fd: int, segment: List[int], segments: Path, state: Dict) -> None:
+        start, end, done = segment
+        ftp = ftp_init()
+        try:
+            ftp.voidcmd("TYPE I")
+            conn = ftp.transfercmd("RETR %s" % source, rest=start + done)
+            with conn, conn.makefile("rb") as reader:
+                self._read_segment(reader, fd, segment, segments, state)
+
+            if end == state["size"]:
+                ftp.voidresp()
+        except ftplib.error_perm as ex:
+            raise DownloadError("%s: %s" % (source, ex)) from ex
+        finally:
+            # transfers of all but the last segment are cut short, do not wait for QUIT
+            ftp.close()
+
+        if self.hasher is not None:
+            self._hash_segments(fd, state)
+
+
+def download_file(url: str, target: Path, progress: Optional[ProgressReporter] = None,
+                  hasher: Optional[StreamHasher] = None) -> None:
+    """Downloads url into target, see HTTPDownloader."""
+    with HTTPDownloader(progress, hasher) as downloader:
+        downloader.download(url, target)
@@ -0,0 +1,164 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, List, NamedTuple, Optional, Tuple, Union
+
+from .sparse import SparseWriter
+
+# ioctl cloning the extents of a file, _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+# data is passed to the kernel in chunks of this size so that progress
+# can be reported while copying large files
+COPY_CHUNK_SIZE = 64 << 20
+BUFFER_SIZE = 1 << 20
+
+# the method is not supported by the file systems or the kernel,
+# the next one is tried from where this one stopped
+FALLBACK_ERRNOS = {errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.ENOTTY,
+                   errno.EOPNOTSUPP, errno.EPERM, errno.EXDEV}
+
+COPY_REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+COPY_SENDFILE = "sendfile"
+COPY_BUFFERED = "buffered"
+
+
+class CopyResult(NamedTuple):
+    # the method that copied the data, or the last one if several were needed
+    method: str
+    size: int
+    duration: float
+    # only known if the data passed through the userspace
+    md5sum: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        """Bytes copied per second."""
+        if self.duration <= 0:
+            return float(self.size)
+
+        return self.size / self.duration
+
+
+class _CopyState:
+    """Position of a copy shared by the methods taking turns on it."""
+
+    def __init__(self, source: BinaryIO, target: BinaryIO, size: int, md5: bool,
+                 progress: Optional[Callable[[int], None]], sparse: bool = False) -> None:
+        self.source = source
+        self.target = target
+        self.sparse = sparse
+        self.size = size
+        self.position = 0
+        self.progress = progress
+        self.hash = hashlib.md5() if md5 else None
+
+    def advance(self, nbytes: int) -> None:
+        self.position += nbytes
+        if self.progress is not None:
+            self.progress(nbytes)
+
+
+def _copy_reflink(state: _CopyState) -> None:
+    # cloning only works for the whole file
+    if state.position > 0:
+        raise OSError(errno.EINVAL, "Reflink of a partial copy")
+
+    fcntl.ioctl(state.target.fileno(), FICLONE, state.source.fileno())
+    state.advance(state.size)
+
+
+def _copy_file_range(state: _CopyState) -> None:
+    while state.position < state.size:
+        copied = os.copy_file_range(state.source.fileno(), state.target.fileno(),
+                                    min(COPY_CHUNK_SIZE, state.size - state.position),
+                                    state.position, state.position)
+        if copied == 0:
+            # some file systems report nothing to copy, let the next method try
+            return
+        state.advance(copied)
+
+
+def _copy_sendfile(state: _CopyState) -> None:
+    os.lseek(state.target.fileno(), state.position, os.SEEK_SET)
+    while state.position < state.size:
+        copied = os.sendfile(state.target.fileno(), state.source.fileno(), state.position,
+                             min(COPY_CHUNK_SIZE, state.size - state.position))
+        if copied == 0:
+            return
+        state.advance(copied)
+
+
+def _copy_buffered(state: _CopyState) -> None:
+    if state.position > 0:
+        # the data copied so far did not pass through
+        state.hash = None
+
+    state.source.seek(state.position)
+    state.target.seek(state.position)
+    writer: Union[BinaryIO, SparseWriter] = SparseWriter(state.target) if state.sparse else state.target
+    while True:
+        chunk = state.source.read(BUFFER_SIZE)
+        if not chunk:
+            break
+        if state.hash is not None:
+            state.hash.update(chunk)
+        writer.write(chunk)
+        state.advance(len(chunk))
+
+    if isinstance(writer, SparseWriter):
+        writer.finish()
+
+
+COPY_METHODS: List[Tuple[str, Callable[[_CopyState], None]]] = [(COPY_REFLINK, _copy_reflink)]
+if hasattr(os, "copy_file_range"):
+    COPY_METHODS.append((COPY_FILE_RANGE, _copy_file_range))
+if hasattr(os, "sendfile"):
+    COPY_METHODS.append((COPY_SENDFILE, _copy_sendfile))
+
+
+def copy_file(source: Path, target: Path, md5: bool = False,
+              progress: Optional[Callable[[int], None]] = None, sparse: bool = False) -> CopyResult:
+    """Copies source to target like shutil.copy(), letting the kernel do the work
+    where possible. Reflinks sharing the extents of source are tried first, then
+    copy_file_range(), sendfile() and finally a read/write loop. progress is called
+    with the number of bytes copied as the copy goes on.
+
+    With md5, the kernel copies are skipped so that the read/write loop hashes
+    the data on the way, sparing another read of target. Only a reflink, which
+    copies no data, is still tried; md5sum of the result is None then.
+
+    With sparse, the kernel copies that write zeros out are skipped and the
+    read/write loop leaves holes in target for blocks of zeros instead."""
+    if target.exists() and source.samefile(target):
+        raise shutil.SameFileError("{!r} and {!r} are the same file".format(source, target))
+
+    start = time.monotonic()
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        state = _CopyState(source_file, target_file, os.fstat(source_file.fileno()).st_size, md5, progress, sparse)
+        method = COPY_BUFFERED
+        for name, copy in COPY_METHODS:
+            if (sparse or md5) and name != COPY_REFLINK:
+                continue
+            try:
+                copy(state)
+            except OSError as ex:
+                if ex.errno not in FALLBACK_ERRNOS:
+                    raise
+                continue
+
+            if state.position >= state.size:
+                method = name
+                break
+
+        if method == COPY_BUFFERED:
+            _copy_buffered(state)
+
+    shutil.copymode(source, target)
+    return CopyResult(method, state.position, time.monotonic() - start,
+                      state.hash.hexdigest() if state.hash is not None and method == COPY_BUFFERED else None)
@@ -0,0 +1,131 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import socket
+import struct
+from pathlib import Path
+from typing import Any, List, NamedTuple, Optional, Union
+
+from .config import Config
+from .taskindex import TaskRecord
+
+CONFIG = Config()
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# seconds the client waits for the daemon before falling back
+INDEXER_TIMEOUT = 5
+
+
+class InotifyEvent(NamedTuple):
+    wd: int
+    mask: int
+    name: str
+
+
+class Inotify:
+    """Minimal ctypes binding of the Linux inotify API. The file descriptor
+    is non-blocking, wait for it to become readable before read_events()."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: %s" % os.strerror(err))
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: Union[str, Path], mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        # fails if the watched directory is already gone, nothing to do then
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[InotifyEvent]:
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append(InotifyEvent(wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def get_indexer_socket() -> Path:
+    return Path(CONFIG["SaveDir"], CONFIG["TaskIndexerSocket"])
+
+
+def query_task_indexer(**filters: Any) -> Optional[List[TaskRecord]]:
+    """Returns records of all tasks matching the filters (see query_task_index())
+    from retrace-server-indexer. Returns None if the indexer is disabled
+    or not running, the caller is expected to fall back to another source."""
+    if not CONFIG["UseTaskIndexer"]:
+        return None
+
+    for key, value in filters.items():
+        if isinstance(value, (tuple, set)):
+            filters[key] = list(value)
+
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(INDEXER_TIMEOUT)
+            sock.connect(str(get_indexer_socket()))
+            sock.sendall(json.dumps({"filters": filters}).encode("utf-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            while True:
+                data = sock.recv(1 << 16)
+                if not data:
+                    break
+                chunks.append(data)
+    except OSError:
+        return None
+
+    try:
+        reply = json.loads(b"".join(chunks).decode("utf-8"))
+    except ValueError:
+        return None
+
+    if "error" in reply:
+        raise ValueError(reply["error"])
+
+    return [TaskRecord(**task) for task in reply["tasks"]]
@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+from .config import Config
+
+CONFIG = Config()
+
+# hardlink to an object being put in place of a task file
+LINK_SUFFIX = ".link"
+
+
+class StoredObject(NamedTuple):
+    path: Path
+    # bytes released by replacing the file with a hardlink to an object stored before
+    saved: int
+
+
+def get_object_store_dir() -> Path:
+    return Path(CONFIG["SaveDir"], CONFIG["ObjectStoreDir"])
+
+
+def get_object_path(digest: str) -> Path:
+    return get_object_store_dir() / digest
+
+
+def store_file(path: Path, digest: str) -> StoredObject:
+    """Moves path into the object store under digest, leaving a hardlink to the object
+    at path. If there already is an object with the same digest, path is atomically
+    replaced by a hardlink to it, releasing the space taken by path."""
+    store_dir = get_object_store_dir()
+    if not store_dir.is_dir():
+        oldmask = os.umask(0o007)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        os.umask(oldmask)
+
+    obj = get_object_path(digest)
+    st = path.stat()
+    while True:
+        try:
+            obj_st = obj.stat()
+        except FileNotFoundError:
+            try:
+                os.link(path, obj)
+            except FileExistsError:
+                # stored by another task in the meantime
+                continue
+            return StoredObject(obj, 0)
+
+        if obj_st.st_ino == st.st_ino and obj_st.st_dev == st.st_dev:
+            return StoredObject(obj, 0)
+
+        if obj_st.st_size != st.st_size:
+            raise Exception("Object %s has size %d, %s with the same digest has %d"
+                            % (obj, obj_st.st_size, path, st.st_size))
+
+        link = path.with_name(path.name + LINK_SUFFIX)
+        try:
+            os.link(obj, link)
+        except FileNotFoundError:
+            # removed by remove_unused_objects() in the meantime
+            continue
+        link.rename(path)
+
+        return StoredObject(obj, st.st_size if st.st_nlink == 1 else 0)
+
+
+def remove_unused_objects() -> int:
+    """Removes objects no longer linked from any task and returns the number of bytes released."""
+    store_dir = get_object_store_dir()
+    if not store_dir.is_dir():
+        return 0
+
+    released = 0
+    with os.scandir(store_dir) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink > 1:
+                continue
+
+            os.unlink(entry.path)
+            released += st.st_size
+
+    return released
@@ -1,23 +1,46 @@
 import errno
+import fcntl
+import functools
+import json
 import logging
 import os
 import grp
 import re
 import random
 import shutil
+import sqlite3
 import stat
 import sys
+import tarfile
+import threading
 import time
 import hashlib
 import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from signal import getsignal, signal, SIG_DFL, SIGPIPE
 from subprocess import DEVNULL, PIPE, STDOUT, TimeoutExpired, run
-from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, List, Literal, NamedTuple, Optional, Set, Tuple, Union
 import magic
 
+from .activetasks import (add_active_task,
+                          count_registered_tasks,
+                          remove_active_task,
+                          replace_active_tasks)
 from .config import Config, PODMAN_BIN, PS_BIN
+from .download import FTPDownloader, HTTPDownloader, StreamHasher
+from .filecopy import copy_file
+from .indexer import query_task_indexer
+from .objectstore import store_file
+from .sparse import copy_sparse, is_sparse, sparsify_file
+from .taskindex import (TaskRecord,
+                        delete_task_index,
+                        filter_task_records,
+                        query_task_index,
+                        update_task_index)
+from .treehash import compute_tree_hash, is_tree_hash_current, verify_tree_hash
+from .unpacker import StreamUnpacker
 from .util import (ARCHIVE_7Z,
                    ARCHIVE_BZ2,
                    ARCHIVE_GZ,
@@ -26,10 +49,18 @@ from .util import (ARCHIVE_7Z,
                    ARCHIVE_UNKNOWN,
                    ARCHIVE_XZ,
                    ARCHIVE_ZIP,
-                   ftp_init,
-                   ftp_close,
+                   ARCHIVE_ZSTD,
+                   DECOMPRESSORS,
+                   COMPRESSION_CODECS,
+                   compress_file,
+                   decompress_file,
+                   get_decompress_command,
+                   human_readable_file_size,
                    human_readable_size,
+                   ProgressReporter,
+                   read_compressed_file,
                    splitFilename)
+from .workers import get_registered_workers, set_worker_phase
 
 # filename: max_size (<= 0 unlimited)
 ALLOWED_FILES = {
@@ -67,9 +98,33 @@ SUFFIX_MAP = {
     ARCHIVE_7Z: ".7z",
     ARCHIVE_TAR: ".tar",
     ARCHIVE_LZOP: ".lzop",
+    ARCHIVE_ZSTD: ".zst",
     ARCHIVE_UNKNOWN: "",
 }
 
+# (offset, magic bytes, archive type) of the formats recognized without libmagic
+ARCHIVE_SIGNATURES = [
+    (0, b"\x1f\x8b", ARCHIVE_GZ),
+    # compress'd data, gunzip handles it as well
+    (0, b"\x1f\x9d", ARCHIVE_GZ),
+    (0, b"\xfd7zXZ\x00", ARCHIVE_XZ),
+    (0, b"7z\xbc\xaf\x27\x1c", ARCHIVE_7Z),
+    (0, b"PK\x03\x04", ARCHIVE_ZIP),
+    # empty and spanned zip archives
+    (0, b"PK\x05\x06", ARCHIVE_ZIP),
+    (0, b"PK\x07\x08", ARCHIVE_ZIP),
+    (0, b"\x89LZO\x00\r\n\x1a\n", ARCHIVE_LZOP),
+    (0, b"\x28\xb5\x2f\xfd", ARCHIVE_ZSTD),
+    (257, b"ustar", ARCHIVE_TAR),
+]
+
+# magic bytes of files known not to be archives: ELF cores, kdump compressed
+# and makedumpfile flattened vmcores, no need to ask libmagic about them
+NOT_ARCHIVE_SIGNATURES = [b"\x7fELF", b"KDUMP   ", b"makedumpfile"]
+
+# enough to see all the signatures above
+ARCHIVE_SNIFF_SIZE = 512
+
 SNAPSHOT_SUFFIXES = [".vmss", ".vmsn", ".vmem"]
 
 BUGZILLA_STATUS = ["NEW", "ASSIGNED", "ON_DEV", "POST", "MODIFIED", "ON_QA", "VERIFIED",
@@ -94,6 +149,12 @@ EXPLOITABLE_SEPARATOR = "== EXPLOITABLE =="
 
 TASKPASS_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
+# SaveDir/123456789
+SAVEDIR_LAYOUT_FLAT = "flat"
+# SaveDir/12/34/123456789
+SAVEDIR_LAYOUT_SHARDED = "sharded"
+SAVEDIR_LAYOUTS = [SAVEDIR_LAYOUT_FLAT, SAVEDIR_LAYOUT_SHARDED]
+
 
 STATUS_ANALYZE, STATUS_INIT, STATUS_BACKTRACE, STATUS_CLEANUP, \
     STATUS_STATS, STATUS_FINISHING, STATUS_SUCCESS, STATUS_FAIL, \
@@ -279,6 +340,17 @@ class RetraceWorkerError(RetraceError):
         self.errorcode = errorcode
 
 
+class UploadRejected(RetraceError):
+    """Raised by extract_upload() when the archive breaks a rule,
+    name is the offending file if any."""
+    SYMLINK, NOT_ALLOWED, FILE_TOO_LARGE, TOO_LARGE, NO_SPACE = range(5)
+
+    def __init__(self, reason: int, name: str = ""):
+        super().__init__("%d %s" % (reason, name))
+        self.reason = reason
+        self.name = name
+
+
 def get_canon_arch(arch: str) -> str:
     for canon_arch, derived_archs in ARCH_MAP.items():
         if arch in derived_archs:
@@ -557,10 +629,51 @@ def get_files_sizes(directory: Union[str, Path]) -> List[Tuple[Path, int]]:
     return sorted(result, key=lambda f_s: f_s[1], reverse=True)
 
 
+def sniff_archive_type(header: bytes) -> Optional[int]:
+    """Returns the archive type of a file starting with header, ARCHIVE_UNKNOWN
+    if it is surely not an archive or None if libmagic needs to decide."""
+    for offset, signature, archive_type in ARCHIVE_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return archive_type
+
+    # bzip2 magic includes the block size
+    if header.startswith(b"BZh") and len(header) > 3 and header[3] in b"123456789":
+        return ARCHIVE_BZ2
+
+    if any(header.startswith(signature) for signature in NOT_ARCHIVE_SIGNATURES):
+        return ARCHIVE_UNKNOWN
+
+    return None
+
+
+_magic_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_magic_cookie() -> Any:
+    cookie = magic.open(magic.MAGIC_NONE)
+    cookie.load()
+    return cookie
+
+
+def get_magic_file_type(path: Union[str, Path]) -> str:
+    """Returns the libmagic description of path. The magic database is loaded
+    on the first call only."""
+    # a cookie must not be used by more threads at once
+    with _magic_lock:
+        return (_get_magic_cookie().file(str(path)) or "").lower()
+
+
 def get_archive_type(path: Union[str, Path]) -> int:
-    ms = magic.open(magic.MAGIC_NONE)
-    ms.load()
-    filetype = ms.file(str(path)).lower()
+    with open(path, "rb") as f:
+        header = f.read(ARCHIVE_SNIFF_SIZE)
+
+    archive_type = sniff_archive_type(header)
+    if archive_type is not None:
+        log_debug("File type sniffed: %s" % (SUFFIX_MAP[archive_type] or "not an archive"))
+        return archive_type
+
+    filetype = get_magic_file_type(path)
     log_debug("File type: %s" % filetype)
 
     if "bzip2 compressed data" in filetype:
@@ -585,6 +698,9 @@ def get_archive_type(path: Union[str, Path]) -> int:
     if "lzop compressed data" in filetype:
         log_debug("lzop detected")
         return ARCHIVE_LZOP
+    if "zstandard compressed data" in filetype:
+        log_debug("zstd detected")
+        return ARCHIVE_ZSTD
 
     log_debug("unknown file type, unpacking finished")
     return ARCHIVE_UNKNOWN
@@ -614,58 +730,99 @@ def rename_with_suffix(frompath: Path, topath: Path) -> Path:
 
     return topath
 
+def _scan_files(directory: Path) -> Set[Path]:
+    with os.scandir(directory) as entries:
+        return set(Path(entry.path) for entry in entries if entry.is_file())
+
+
+def _run_listing(cmd: List[str]) -> List[str]:
+    """Like check_run() but returns the lines printed to stdout."""
+    child = run(cmd, stdout=PIPE, stderr=PIPE, encoding='utf-8', errors='surrogateescape', check=False)
+    if child.returncode:
+        raise Exception("%s exited with %d: %s" % (cmd[0], child.returncode, child.stderr))
+
+    return child.stdout.splitlines()
+
+
+def _get_listed_files(directory: Path, names: Iterable[str]) -> List[Path]:
+    result = []
+    for name in names:
+        # directories end with a slash
+        if not name or name.endswith("/"):
+            continue
+        path = directory / name
+        if path not in result and path.is_file():
+            result.append(path)
+
+    return result
+
+
+def get_unpack_threads() -> int:
+    """Returns the number of threads a task may use for decompression:
+    UnpackThreads if set, otherwise the CPUs shared among running workers.
+    The calling worker is among them, so there is always at least one."""
+    if CONFIG["UnpackThreads"] > 0:
+        return CONFIG["UnpackThreads"]
+
+    return max(1, (os.cpu_count() or 1) // max(1, len(get_running_tasks())))
+
+
+def extract_archive(archive: Path, filetype: int, targetdir: Path, threads: int = 1) -> List[Path]:
+    """Unpacks archive of filetype and returns the files it produced. Tar, zip
+    and 7z archives are extracted into targetdir, compressed files next to
+    archive. The files are found from the archive listing or by comparing
+    a single directory before and after, so that nested archives
+    do not need a walk of the whole tree per step. Compressed files are
+    decompressed by up to threads threads if a parallel tool is installed."""
+    if filetype == ARCHIVE_TAR:
+        return _get_listed_files(targetdir, _run_listing(["tar", "-C", str(targetdir), "-xvf", str(archive)]))
+
+    if filetype == ARCHIVE_ZIP:
+        check_run(["unzip", str(archive), "-d", str(targetdir)])
+        return _get_listed_files(targetdir, _run_listing(["unzip", "-Z1", str(archive)]))
+
+    # the remaining tools create files in a single directory
+    outdir = targetdir if filetype == ARCHIVE_7Z else archive.parent
+    before = _scan_files(outdir)
+    if filetype in DECOMPRESSORS:
+        check_run(get_decompress_command(filetype, threads) + [str(archive)])
+    elif filetype == ARCHIVE_7Z:
+        check_run(["7za", "e", "-o%s" % targetdir, str(archive)])
+    elif filetype == ARCHIVE_LZOP:
+        check_run(["lzop", "-d", str(archive)])
+    else:
+        raise Exception("Unknown archive type")
+
+    return sorted(_scan_files(outdir) - before)
+
+
 def unpack_vmcore(path: Path) -> None:
     vmcore_file = "vmcore"
     parentdir = path.parent
     archivebase = parentdir / "archive"
     archive = rename_with_suffix(path, archivebase)
     filetype = get_archive_type(archive)
+    threads = get_unpack_threads() if filetype != ARCHIVE_UNKNOWN else 1
     while filetype != ARCHIVE_UNKNOWN:
-        files = set(f for (f, s) in get_files_sizes(parentdir))
-        if filetype == ARCHIVE_GZ:
-            check_run(["gunzip", str(archive)])
-        elif filetype == ARCHIVE_BZ2:
-            check_run(["bunzip2", str(archive)])
-        elif filetype == ARCHIVE_XZ:
-            check_run(["unxz", str(archive)])
-        elif filetype == ARCHIVE_ZIP:
-            check_run(["unzip", str(archive), "-d", str(parentdir)])
-        elif filetype == ARCHIVE_7Z:
-            check_run(["7za", "e", "-o%s" % parentdir, str(archive)])
-        elif filetype == ARCHIVE_TAR:
-            check_run(["tar", "-C", str(parentdir), "-xf", str(archive)])
-        elif filetype == ARCHIVE_LZOP:
-            check_run(["lzop", "-d", str(archive)])
-        else:
-            raise Exception("Unknown archive type")
+        produced = [f for f in extract_archive(archive, filetype, parentdir, threads) if f != archive]
 
         if archive.is_file():
             archive.unlink()
 
-        files_sizes = get_files_sizes(parentdir)
-        newfiles = [f for (f, s) in files_sizes if f.suffix != ".vmem"]
-        diff = set(newfiles) - files
-        vmcore_candidate = 0
-        while vmcore_candidate < len(newfiles) and newfiles[vmcore_candidate] not in diff:
-            vmcore_candidate += 1
+        # the largest new file is the vmcore or the next archive
+        candidates = sorted((f for f in produced if f.suffix != ".vmem" and f.is_file()),
+                            key=lambda f: f.stat().st_size, reverse=True)
 
         # rename files with .vmem extension to vmcore.vmem
         for f in Path(parentdir).iterdir():
             if f.suffix == ".vmem":
                 f.rename(Path(parentdir, vmcore_file + f.suffix))
 
-        if len(diff) > 1:
-            archive = rename_with_suffix(newfiles[vmcore_candidate], archivebase)
-            for filename in newfiles:
-                if filename not in diff or \
-                   filename == newfiles[vmcore_candidate]:
-                    continue
-
+        if candidates:
+            archive = rename_with_suffix(candidates[0], archivebase)
+            for filename in candidates[1:]:
                 filename.unlink()
 
-        elif len(diff) == 1:
-            archive = rename_with_suffix(diff.pop(), archivebase)
-
         # just be explicit here - if no file changed, an archive
         # has most probably been unpacked to a file with same name
         else:
@@ -684,32 +841,23 @@ def unpack_vmcore(path: Path) -> None:
 def unpack_coredump(path: Path) -> None:
     processed: Set[Path] = set()
     parentdir = path.parent
-    files = set(f for (f, s) in get_files_sizes(parentdir))
-    # Keep unpacking
-    while len(files - processed) > 0:
-        archive = list(files - processed)[0]
-        filetype = get_archive_type(archive)
-        archive_path = str(archive)
-        if filetype == ARCHIVE_GZ:
-            check_run(["gunzip", archive_path])
-        elif filetype == ARCHIVE_BZ2:
-            check_run(["bunzip2", archive_path])
-        elif filetype == ARCHIVE_XZ:
-            check_run(["unxz", archive_path])
-        elif filetype == ARCHIVE_ZIP:
-            check_run(["unzip", archive_path, "-d", str(parentdir)])
-        elif filetype == ARCHIVE_7Z:
-            check_run(["7za", "e", "-o%s" % parentdir, archive_path])
-        elif filetype == ARCHIVE_TAR:
-            check_run(["tar", "-C", str(parentdir), "-xf", archive_path])
-        elif filetype == ARCHIVE_LZOP:
-            check_run(["lzop", "-d", archive_path])
-
-        if archive.is_file() and filetype != ARCHIVE_UNKNOWN:
-            archive.unlink()
+    pending = [f for (f, s) in get_files_sizes(parentdir)]
+    threads = get_unpack_threads()
+    # Keep unpacking, files produced by an archive are checked next
+    while pending:
+        archive = pending.pop()
+        if archive in processed or not archive.is_file():
+            continue
         processed.add(archive)
 
-        files = set(f for (f, s) in get_files_sizes(parentdir))
+        filetype = get_archive_type(archive)
+        if filetype == ARCHIVE_UNKNOWN:
+            continue
+
+        produced = extract_archive(archive, filetype, parentdir, threads)
+        if archive.is_file():
+            archive.unlink()
+        pending.extend(f for f in produced if f != archive)
 
     # If coredump is not present, the biggest file becomes it
     if "coredump" not in [f.name for f in parentdir.iterdir()]:
@@ -720,6 +868,70 @@ def unpack_coredump(path: Path) -> None:
             shutil.rmtree(filename)
 
 
+# tarfile stream modes of the upload formats decoded in-process
+UPLOAD_STREAM_MODES: Dict[int, Literal["r|", "r|gz", "r|bz2", "r|xz"]] = {
+    ARCHIVE_TAR: "r|",
+    ARCHIVE_GZ: "r|gz",
+    ARCHIVE_BZ2: "r|bz2",
+    ARCHIVE_XZ: "r|xz",
+}
+
+
+def is_allowed_file(name: str) -> bool:
+    path = Path(name)
+    return path.stem in ALLOWED_FILES and (not path.suffix or path.suffix in SNAPSHOT_SUFFIXES)
+
+
+def extract_upload(fileobj: Any, archive_type: int, crashdir: Path, space: int) -> List[Path]:
+    """Extracts a tar archive of archive_type (see UPLOAD_STREAM_MODES) read
+    from fileobj into crashdir as it arrives. Every member is checked from
+    its header before any of its data is written: only regular files from
+    ALLOWED_FILES within their size limits are accepted, and the total may
+    not exceed MaxUnpackedSize nor leave less than MinStorageLeft of space.
+    Raises UploadRejected on the first violation and tarfile.TarError,
+    EOFError or a decompressor error if the archive is broken."""
+    max_size = CONFIG["MaxUnpackedSize"] << 20
+    min_left = CONFIG["MinStorageLeft"] << 20
+    files = []
+    total = 0
+    with tarfile.open(fileobj=fileobj, mode=UPLOAD_STREAM_MODES[archive_type], bufsize=1 << 20) as tar:
+        for member in tar:
+            name = member.name
+            while name.startswith("./"):
+                name = name[2:]
+            if member.isdir() and name in ["", "."]:
+                continue
+
+            if member.issym() or member.islnk():
+                raise UploadRejected(UploadRejected.SYMLINK, name)
+
+            if not member.isfile() or "/" in name.rstrip("/") or not is_allowed_file(name):
+                raise UploadRejected(UploadRejected.NOT_ALLOWED, name)
+
+            maxsize = ALLOWED_FILES[Path(name).stem]
+            if maxsize > 0 and member.size > maxsize:
+                raise UploadRejected(UploadRejected.FILE_TOO_LARGE, name)
+
+            total += member.size
+            if total > max_size:
+                raise UploadRejected(UploadRejected.TOO_LARGE, name)
+            if space - total < min_left:
+                raise UploadRejected(UploadRejected.NO_SPACE, name)
+
+            path = crashdir / name
+            source = tar.extractfile(member)
+            assert source is not None
+            with open(path, "wb") as target:
+                if CONFIG["SparseFiles"]:
+                    copy_sparse(source, target, 1 << 20)
+                else:
+                    shutil.copyfileobj(source, target, 1 << 20)
+            if path not in files:
+                files.append(path)
+
+    return files
+
+
 def run_ps() -> List[str]:
     lines = run([PS_BIN, "-eo", "pid,ppid,etimes,cmd"],
                 stdout=PIPE, encoding="utf-8", check=False).stdout.splitlines()
@@ -728,6 +940,12 @@ def run_ps() -> List[str]:
 
 
 def get_running_tasks(ps_output: Optional[List[str]] = None) -> List[Tuple[int, int, int]]:
+    """Returns (PID, task ID, elapsed seconds) of all running workers.
+    Uses the worker registry if enabled and ps output is not given."""
+    if ps_output is None and CONFIG["UseWorkerRegistry"]:
+        now = int(time.time())
+        return [(worker.pid, worker.taskid, now - worker.started) for worker in get_registered_workers()]
+
     if ps_output is None:
         ps_output = run_ps()
 
@@ -744,15 +962,79 @@ def get_running_tasks(ps_output: Optional[List[str]] = None) -> List[Tuple[int,
     return result
 
 
+def get_task_dir(taskid: int, layout: Optional[str] = None) -> Path:
+    """Returns the directory of the task in the given SaveDir layout,
+    the configured one by default. The directory may not exist."""
+    if layout is None:
+        layout = CONFIG["SaveDirLayout"]
+
+    name = "%d" % taskid
+    if layout == SAVEDIR_LAYOUT_SHARDED:
+        return Path(CONFIG["SaveDir"], name[0:2], name[2:4], name)
+
+    return Path(CONFIG["SaveDir"], name)
+
+
+def find_task_dir(taskid: int) -> Optional[Path]:
+    """Returns the directory of an existing task. Tasks not migrated
+    to the configured SaveDir layout yet are found as well."""
+    layouts = [CONFIG["SaveDirLayout"]]
+    layouts += [layout for layout in SAVEDIR_LAYOUTS if layout != CONFIG["SaveDirLayout"]]
+    for layout in layouts:
+        taskdir = get_task_dir(taskid, layout)
+        if taskdir.is_dir():
+            return taskdir
+
+    return None
+
+
+def _is_shard_dir(entry: os.DirEntry) -> bool:
+    return len(entry.name) == 2 and entry.name.isdigit() and entry.is_dir()
+
+
+def _is_task_dir(entry: os.DirEntry) -> bool:
+    return len(entry.name) == CONFIG["TaskIdLength"] and entry.name.isdigit() and entry.is_dir()
+
+
+def scan_task_dirs() -> List[Path]:
+    """Returns directories of all tasks in SaveDir in any layout."""
+    result = []
+    with os.scandir(CONFIG["SaveDir"]) as entries:
+        for entry in entries:
+            if _is_task_dir(entry):
+                result.append(Path(entry.path))
+            elif _is_shard_dir(entry):
+                with os.scandir(entry.path) as shards:
+                    for shard in shards:
+                        if not _is_shard_dir(shard):
+                            continue
+
+                        with os.scandir(shard.path) as tasks:
+                            result.extend(Path(task.path) for task in tasks if _is_task_dir(task))
+
+    return result
+
+
 def get_active_tasks() -> List[int]:
-    tasks = []
+    filters: Dict[str, Any] = {"has_log": False}
+    if CONFIG["AllowTaskManager"]:
+        filters["managed"] = False
 
-    for filename in Path(CONFIG["SaveDir"]).iterdir():
-        if len(filename.name) != CONFIG["TaskIdLength"]:
-            continue
+    records = query_task_indexer(**filters)
+    if records is not None:
+        return [record.taskid for record in records]
 
+    if CONFIG["UseTaskIndex"]:
         try:
-            task = RetraceTask(int(filename.name))
+            return [record.taskid for record in query_task_index(**filters)]
+        except sqlite3.Error as ex:
+            log_warn("Unable to query task index, scanning %s: %s" % (CONFIG["SaveDir"], ex))
+
+    tasks = []
+
+    for taskid in get_task_ids(use_index=False):
+        try:
+            task = RetraceTask(taskid)
         except Exception:
             continue
 
@@ -765,6 +1047,27 @@ def get_active_tasks() -> List[int]:
     return tasks
 
 
+def count_active_tasks() -> int:
+    """Returns the number of active tasks for admission control. Uses the active
+    task registry if enabled, which does not need to look into SaveDir."""
+    if CONFIG["UseActiveTaskRegistry"]:
+        try:
+            return count_registered_tasks()
+        except sqlite3.Error as ex:
+            log_warn("Unable to query active task registry: %s" % ex)
+
+    return len(get_active_tasks())
+
+
+def reconcile_active_tasks() -> Tuple[Set[int], Set[int]]:
+    """Rebuilds the active task registry from the task directories. Returns
+    task IDs that were missing in the registry and those that were stale."""
+    active = set(get_active_tasks())
+    previous = replace_active_tasks(active)
+
+    return active - previous, previous - active
+
+
 def check_run(cmd: List[str]) -> None:
     child = run(cmd, stdout=PIPE, stderr=STDOUT, encoding='utf-8', check=False)
     stdout = child.stdout
@@ -858,26 +1161,79 @@ def find_kernel_debuginfo(kernelver: KernelVer) -> Optional[Path]:
             downloaddir.mkdir(parents=True)
             os.umask(oldmask)
 
-        for ver in vers:
-            pkgname = ver.package_name(debug=True)
-            url = CONFIG["KernelDebuginfoURL"] \
-                .replace("$VERSION", ver.version) \
-                .replace("$RELEASE", ver.release) \
-                .replace("$ARCH", ver._arch) \
-                .replace("$BASENAME", basename)
-            if not url.endswith("/"):
-                url += "/"
-            url += pkgname
-
-            log_debug("Trying debuginfo URL: %s" % url)
-            child = run(["wget", "-nv", "-P", downloaddir, url],
-                        stdout=DEVNULL, stderr=DEVNULL, check=False)
-            if not child.returncode:
+        # the URLs usually point to the same server, reuse the connection
+        with HTTPDownloader() as downloader:
+            for ver in vers:
+                pkgname = ver.package_name(debug=True)
+                url = CONFIG["KernelDebuginfoURL"] \
+                    .replace("$VERSION", ver.version) \
+                    .replace("$RELEASE", ver.release) \
+                    .replace("$ARCH", ver._arch) \
+                    .replace("$BASENAME", basename)
+                if not url.endswith("/"):
+                    url += "/"
+                url += pkgname
+
+                log_debug("Trying debuginfo URL: %s" % url)
+                try:
+                    downloader.download(url, downloaddir / pkgname)
+                except Exception as ex:
+                    log_debug("Download failed: %s" % ex)
+                    continue
+
                 return downloaddir / pkgname
 
     return None
 
 
+class RemoteResult(NamedTuple):
+    """Outcome of fetching a single remote resource, see RetraceTask.download_remote()."""
+    filename: Optional[str] = None
+    # entry for DOWNLOADED_FILE
+    downloaded: Optional[str] = None
+    # computed during the download if requested, None if the data was not streamed
+    md5sum: Optional[str] = None
+    error: Optional[Tuple[str, str]] = None
+
+
+class TaskSnapshot(NamedTuple):
+    """Metadata of a task read at a single point in time, see RetraceTask.snapshot()."""
+    taskid: int
+    type: int
+    status: Optional[int]
+    managed: bool
+    has_log: bool
+    has_backtrace: bool
+    has_mock: bool
+    has_crashrc: bool
+    caseno: Optional[int]
+    bugzillano: List[str]
+    started_time: Optional[int]
+    finished_time: Optional[int]
+    default_started_time: int
+    default_finished_time: int
+    downloaded: Optional[str]
+    remote: List[str]
+    md5sum: Optional[str]
+    notify: List[str]
+    url: Optional[str]
+    notes: Optional[str]
+    kernelver: Optional[str]
+    vmlinux: Optional[str]
+    crash_cmd: Optional[str]
+    progress: Optional[str]
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
 class RetraceTask:
     """Represents Retrace server's task."""
 
@@ -889,6 +1245,7 @@ class RetraceTask:
     CRASH_CMD_FILE = "crash_cmd"
     DOWNLOADED_FILE = "downloaded"
     MD5SUM_FILE = "md5sum"
+    TREE_HASH_FILE = "treehash"
     FINISHED_FILE = "finished_time"
     KERNELVER_FILE = "kernelver"
     LOG_FILE = "retrace_log"
@@ -908,17 +1265,91 @@ class RetraceTask:
     VMCORE_FILE = "vmcore"
     VMEM_FILE = "vmcore.vmem"
     COREDUMP_FILE = "coredump"
+    MANIFEST_FILE = "manifest.json"
     MOCK_DEFAULT_CFG = "default.cfg"
     MOCK_SITE_DEFAULTS_CFG = "site-defaults.cfg"
     MOCK_LOGGING_INI = "logging.ini"
     CONTAINERFILE = "Containerfile"
 
+    # file: task index column
+    INDEXED_FILES = {
+        TYPE_FILE: "type",
+        STATUS_FILE: "status",
+        MANAGED_FILE: "managed",
+        LOG_FILE: "has_log",
+        CASENO_FILE: "caseno",
+        BUGZILLANO_FILE: "bugzillano",
+        STARTED_FILE: "started_time",
+        FINISHED_FILE: "finished_time",
+        DOWNLOADED_FILE: "downloaded",
+        REMOTE_FILE: "remote",
+        MD5SUM_FILE: "md5sum",
+    }
+
+    # version of MANIFEST_FILE written by this code
+    MANIFEST_VERSION = 1
+
+    # small metadata files kept together in MANIFEST_FILE by tasks
+    # in the manifest format, see UseTaskManifest
+    MANIFEST_KEYS = {
+        TYPE_FILE,
+        STATUS_FILE,
+        MANAGED_FILE,
+        CASENO_FILE,
+        BUGZILLANO_FILE,
+        STARTED_FILE,
+        FINISHED_FILE,
+        DOWNLOADED_FILE,
+        REMOTE_FILE,
+        MD5SUM_FILE,
+        NOTIFY_FILE,
+        URL_FILE,
+        NOTES_FILE,
+        PASSWORD_FILE,
+        KERNELVER_FILE,
+        VMLINUX_FILE,
+        PROGRESS_FILE,
+    }
+
+    # file: max length read by snapshot()
+    SNAPSHOT_FILES = {
+        TYPE_FILE: 8,
+        STATUS_FILE: 8,
+        CASENO_FILE: 1 << 8,
+        BUGZILLANO_FILE: 1 << 8,
+        STARTED_FILE: 1 << 8,
+        FINISHED_FILE: 1 << 8,
+        DOWNLOADED_FILE: 1 << 22,
+        REMOTE_FILE: 1 << 22,
+        MD5SUM_FILE: 1 << 22,
+        NOTIFY_FILE: 1 << 16,
+        URL_FILE: 1 << 14,
+        NOTES_FILE: 1 << 22,
+        KERNELVER_FILE: 1 << 16,
+        VMLINUX_FILE: 1 << 22,
+        CRASH_CMD_FILE: 1 << 22,
+        PROGRESS_FILE: 1 << 8,
+    }
+
+    # files compressed by compress_files(), read back transparently
+    COMPRESSIBLE_FILES = [BACKTRACE_FILE, LOG_FILE]
+    # compressed copy: file
+    COMPRESSED_FILES = {key + SUFFIX_MAP[archive_type]: key
+                        for key in COMPRESSIBLE_FILES
+                        for archive_type in COMPRESSION_CODECS.values()}
+
     def __init__(self, taskid: Optional[Union[int, str]] = None):
         """Creates a new task if taskid is None,
         loads the task with given ID otherwise."""
 
         self.vmcore_file = self.VMCORE_FILE
         self._debuginfod_enabled = False
+        # receives download progress strings, see ProgressReporter
+        self.progress_sink: Callable[[str], None] = self.set_progress
+        self._progress: Optional[ProgressReporter] = None
+        # parsed MANIFEST_FILE and the stat() result it was read with
+        self._manifest: Optional[Dict[str, str]] = None
+        self._manifest_stat: Optional[Tuple[int, int, int]] = None
 
         if taskid is None:
             # create a new task
@@ -929,8 +1360,13 @@ class RetraceTask:
             for _ in range(50):
                 taskid = generator.randint(pow(10, CONFIG["TaskIdLength"] - 1),
                                            pow(10, CONFIG["TaskIdLength"]) - 1)
-                taskdir = Path(CONFIG["SaveDir"], "%d" % taskid)
+                # the ID may be taken by a task in the other layout
+                if find_task_dir(taskid) is not None:
+                    continue
+
+                taskdir = get_task_dir(taskid)
                 try:
+                    taskdir.parent.mkdir(parents=True, exist_ok=True)
                     taskdir.mkdir()
                 except OSError as ex:
                     # dir exists, try another taskid
@@ -947,10 +1383,14 @@ class RetraceTask:
             if self._taskid is None:
                 raise Exception("Unable to create new task")
 
-            pwdfilepath = self._savedir / RetraceTask.PASSWORD_FILE
-            with open(pwdfilepath, "w") as pwdfile:
-                for _ in range(CONFIG["TaskPassLength"]):
-                    pwdfile.write(generator.choice(TASKPASS_ALPHABET))
+            password = "".join(generator.choice(TASKPASS_ALPHABET)
+                               for _ in range(CONFIG["TaskPassLength"]))
+            if CONFIG["UseTaskManifest"]:
+                self._write_manifest({RetraceTask.PASSWORD_FILE: password})
+            else:
+                pwdfilepath = self._savedir / RetraceTask.PASSWORD_FILE
+                with open(pwdfilepath, "w") as pwdfile:
+                    pwdfile.write(password)
 
             cmd = "crash"
             if CONFIG["KernelDebuggerPath"]:
@@ -958,12 +1398,15 @@ class RetraceTask:
             self.set_crash_cmd(cmd)
             (self._savedir / RetraceTask.RESULTS_DIR).mkdir(parents=True)
             os.umask(oldmask)
+            self.update_index()
+            self.update_active_registry()
         else:
             # existing task
             self._taskid = int(taskid)
-            self._savedir = Path(CONFIG["SaveDir"], "%d" % self._taskid)
-            if not self._savedir.is_dir():
+            savedir = find_task_dir(self._taskid)
+            if savedir is None:
                 raise Exception("The task %d does not exist" % self._taskid)
+            self._savedir = savedir
             if not self.has_crash_cmd():
                 cmd = "crash"
                 if CONFIG["KernelDebuggerPath"]:
@@ -1048,6 +1491,11 @@ class RetraceTask:
         """Returns task's savedir"""
         return self._savedir
 
+    def get_kernel_dir(self) -> Path:
+        """Returns the directory with mock configuration for vmcore tasks,
+        a sibling of the task directory."""
+        return self._savedir.parent / ("%d-kernel" % self.get_taskid())
+
     def get_crashdir(self) -> Path:
         """Returns task's crashdir"""
         return self._savedir / "crash"
@@ -1107,52 +1555,451 @@ class RetraceTask:
         if mode not in ["w", "a"]:
             raise ValueError("mode must be either 'w' or 'a'")
 
+        if mode == "a":
+            self.append(key, value)
+            return
+
+        if self._in_manifest(key):
+            self._update_manifest({str(key): value})
+            self.file_changed(key)
+            return
+
         with open(self._get_file_path(key), mode) as f:
             f.write(value)
             self.chgrp(key)
             self.chmod(key)
 
+        self._remove_compressed(key)
+        self.file_changed(key)
+
     def set_atomic(self, key: Union[str, Path], value: Union[str, bytes],
                    mode: str = "w") -> None:
         if mode not in ["w", "a", "wb"]:
             raise ValueError("mode must be 'w', 'a', or 'wb'")
 
-        tmpfilename = self._get_file_path("%s.tmp" % key)
-        filename = self._get_file_path(key)
+        # rewriting the whole file would make every append O(size)
         if mode == "a":
-            try:
-                shutil.copyfile(filename, tmpfilename)
-            except IOError as ex:
-                if ex.errno != errno.ENOENT:
-                    raise
+            self.append(key, value)
+            return
 
+        # manifest updates are atomic on their own
+        if self._in_manifest(key):
+            self._update_manifest({str(key): value})
+            self.file_changed(key)
+            return
+
+        tmpfilename = self._get_file_path("%s.tmp" % key)
+        filename = self._get_file_path(key)
         with open(tmpfilename, mode) as f:
             f.write(value)
 
         tmpfilename.rename(filename)
         self.chgrp(key)
         self.chmod(key)
+        self._remove_compressed(key)
+        self.file_changed(key)
+
+    def append(self, key: Union[str, Path], value: Union[str, bytes]) -> None:
+        """Appends value to the file in place using O_APPEND followed by fsync.
+        The existing contents are never rewritten, so the cost does not
+        depend on the size of the file."""
+        if self._in_manifest(key):
+            if isinstance(value, bytes):
+                value = value.decode("utf-8", errors="replace")
+            self._update_manifest({str(key): value}, append=True)
+            self.file_changed(key)
+            return
+
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+
+        self._decompress(key)
+        filename = self._get_file_path(key)
+        created = False
+        try:
+            fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+            created = True
+        except FileExistsError:
+            fd = os.open(filename, os.O_WRONLY | os.O_APPEND)
+
+        try:
+            data = memoryview(value)
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if created:
+            self.chgrp(key)
+            self.chmod(key)
+
+        self.file_changed(key)
 
     # 256MB should be enough by default
     def get(self, key: Union[str, Path], maxlen: int = 268435456) -> Optional[str]:
-        if not self.has(key):
+        if self._in_manifest(key):
+            manifest = self._read_manifest()
+            if manifest is not None and str(key) in manifest:
+                return manifest[str(key)][:maxlen]
+
+        if not self.has_file(key):
             return None
 
         filename = self._get_file_path(key)
+        if not filename.is_file():
+            compressed = self._get_compressed(key)
+            if compressed is not None:
+                return read_compressed_file(compressed[0], compressed[1], maxlen)
+
         with open(filename, "r", encoding='utf-8', errors='replace') as f:
             result = f.read(maxlen)
 
         return result
 
     def has(self, key: Union[str, Path]):
-        return self._get_file_path(key).is_file()
+        if self._in_manifest(key):
+            manifest = self._read_manifest()
+            if manifest is not None and str(key) in manifest:
+                return True
+
+        return self.has_file(key)
+
+    def has_file(self, key: Union[str, Path]) -> bool:
+        """Verifies whether key is stored as a separate file
+        regardless of the task format."""
+        return self._get_file_path(key).is_file() or self._get_compressed(key) is not None
+
+    def _get_compressed(self, key: Union[str, Path]) -> Optional[Tuple[Path, int]]:
+        """Returns the path and archive type of the compressed copy of key."""
+        if str(key) not in RetraceTask.COMPRESSIBLE_FILES:
+            return None
+
+        for archive_type in COMPRESSION_CODECS.values():
+            filename = self._get_file_path(str(key) + SUFFIX_MAP[archive_type])
+            if filename.is_file():
+                return filename, archive_type
+
+        return None
+
+    def _remove_compressed(self, key: Union[str, Path]) -> None:
+        """Removes the compressed copy of key, replaced by a new plain file."""
+        compressed = self._get_compressed(key)
+        while compressed is not None:
+            compressed[0].unlink()
+            compressed = self._get_compressed(key)
+
+    def _decompress(self, key: Union[str, Path]) -> None:
+        """Turns the compressed copy of key back into a plain file
+        so that it can be appended to."""
+        compressed = self._get_compressed(key)
+        if compressed is None or self._get_file_path(key).is_file():
+            return
+
+        decompress_file(compressed[0], self._get_file_path(key), compressed[1])
+        self._remove_compressed(key)
+
+    def compress_files(self, codec: str, threads: int = 1) -> List[str]:
+        """Compresses the backtrace and the log by codec, a key of COMPRESSION_CODECS.
+        They are still read by get_backtrace() and get_log() and restored
+        when changed. Returns the keys compressed."""
+        archive_type = COMPRESSION_CODECS[codec]
+        # the age of the task is that of its directory
+        st = self._savedir.stat()
+
+        result = []
+        for key in RetraceTask.COMPRESSIBLE_FILES:
+            filename = self._get_file_path(key)
+            if not filename.is_file() or filename.stat().st_size == 0:
+                continue
+
+            compress_file(filename, self._get_file_path(key + SUFFIX_MAP[archive_type]), archive_type, threads)
+            filename.unlink()
+            result.append(key)
+
+        # the log linked from the results directory
+        compressed = self._get_compressed(RetraceTask.LOG_FILE)
+        results_dir = self.get_results_dir()
+        if compressed is not None and results_dir.is_dir():
+            for link in results_dir.glob("retrace-log*"):
+                if link.is_symlink() and not link.exists():
+                    link.unlink()
+                    (results_dir / ("retrace-log" + SUFFIX_MAP[compressed[1]])).symlink_to(compressed[0])
+
+        os.utime(self._savedir, ns=(st.st_atime_ns, st.st_mtime_ns))
+        return result
 
     def touch(self, key: Union[str, Path]):
+        if self._in_manifest(key):
+            if not self.has(key):
+                self._update_manifest({str(key): ""})
+                self.file_changed(key)
+            return
+
         open(self._get_file_path(key), "a").close()
+        self.file_changed(key)
 
     def delete(self, key: Union[str, Path]):
-        if self.has(key):
+        if self._in_manifest(key):
+            manifest = self._read_manifest()
+            if manifest is not None and str(key) in manifest:
+                self._update_manifest({str(key): None})
+                self.file_changed(key)
+
+        if self.has_file(key):
             self._get_file_path(key).unlink()
+            self.file_changed(key)
+
+    def has_manifest(self) -> bool:
+        """Verifies whether the task is stored in the manifest format."""
+        return self._get_file_path(RetraceTask.MANIFEST_FILE).is_file()
+
+    def _in_manifest(self, key: Union[str, Path]) -> bool:
+        return str(key) in RetraceTask.MANIFEST_KEYS and self.has_manifest()
+
+    def _read_manifest(self, cached: bool = True) -> Optional[Dict[str, str]]:
+        """Returns contents of MANIFEST_FILE, None if the task is stored
+        in the file-per-key format. The parsed manifest is kept until
+        the file is replaced."""
+        filename = self._get_file_path(RetraceTask.MANIFEST_FILE)
+        try:
+            if cached and self._manifest is not None and self._manifest_stat == self._stat_manifest():
+                return self._manifest
+
+            with open(filename, "r", encoding="utf-8") as f:
+                st = os.fstat(f.fileno())
+                data = json.load(f)
+        except FileNotFoundError:
+            self._manifest = None
+            self._manifest_stat = None
+            return None
+
+        if data.get("version", 0) > RetraceTask.MANIFEST_VERSION:
+            raise Exception("Task %d uses unsupported manifest version %s"
+                            % (self.get_taskid(), data["version"]))
+
+        self._manifest = data["files"]
+        self._manifest_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        return self._manifest
+
+    def _stat_manifest(self) -> Tuple[int, int, int]:
+        st = self._get_file_path(RetraceTask.MANIFEST_FILE).stat()
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _write_manifest(self, files: Dict[str, str]) -> None:
+        data = {"version": RetraceTask.MANIFEST_VERSION, "taskid": self.get_taskid(), "files": files}
+        tmpfilename = self._get_file_path("%s.tmp" % RetraceTask.MANIFEST_FILE)
+        # the manifest holds the password, do not make it world-readable
+        fd = os.open(tmpfilename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, sort_keys=True)
+            os.fchmod(f.fileno(), 0o640)
+
+        tmpfilename.rename(self._get_file_path(RetraceTask.MANIFEST_FILE))
+        self.chgrp(RetraceTask.MANIFEST_FILE)
+        self._manifest = files
+        self._manifest_stat = self._stat_manifest()
+
+    def _lock_manifest(self) -> int:
+        """Serializes manifest updates between processes. Returns a file
+        descriptor to pass to _unlock_manifest()."""
+        fd = os.open(self._savedir, os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    @staticmethod
+    def _unlock_manifest(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _update_manifest(self, changes: Dict[str, Optional[Union[str, bytes]]],
+                         append: bool = False) -> None:
+        """Applies changes to MANIFEST_FILE, None removes the key.
+        Other processes may have changed the manifest meanwhile,
+        so it is always re-read under the lock."""
+        fd = self._lock_manifest()
+        try:
+            files = dict(self._read_manifest(cached=False) or {})
+            for key, value in changes.items():
+                if value is None:
+                    files.pop(key, None)
+                    continue
+
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8", errors="replace")
+
+                if append:
+                    value = files.get(key, "") + value
+                files[key] = value
+
+            self._write_manifest(files)
+        finally:
+            self._unlock_manifest(fd)
+
+    def convert_to_manifest(self) -> bool:
+        """Moves the metadata files of the task into MANIFEST_FILE.
+        Can be repeated if interrupted, values already in the manifest
+        win over leftover files. Returns False if there was nothing to do."""
+        fd = self._lock_manifest()
+        try:
+            manifest = self._read_manifest(cached=False)
+            files = dict(manifest or {})
+            leftovers = [key for key in RetraceTask.MANIFEST_KEYS if self.has_file(key)]
+            if manifest is not None and not leftovers:
+                return False
+
+            for key in leftovers:
+                if key not in files:
+                    with open(self._get_file_path(key), "r", encoding="utf-8", errors="replace") as f:
+                        files[key] = f.read()
+
+            self._write_manifest(files)
+
+            for key in leftovers:
+                self._get_file_path(key).unlink()
+        finally:
+            self._unlock_manifest(fd)
+
+        return True
+
+    def _get_index_values(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Reads the task index columns corresponding to given files
+        from the task directory."""
+        getters: Dict[str, Callable[[], Any]] = {
+            RetraceTask.TYPE_FILE: self.get_type,
+            RetraceTask.STATUS_FILE: self.get_status,
+            RetraceTask.MANAGED_FILE: lambda: self.has(RetraceTask.MANAGED_FILE),
+            RetraceTask.LOG_FILE: self.has_log,
+            RetraceTask.CASENO_FILE: self.get_caseno,
+            RetraceTask.BUGZILLANO_FILE: lambda: self.get(RetraceTask.BUGZILLANO_FILE, maxlen=1 << 8),
+            RetraceTask.STARTED_FILE: self.get_started_time,
+            RetraceTask.FINISHED_FILE: self.get_finished_time,
+            RetraceTask.DOWNLOADED_FILE: self.get_downloaded,
+            RetraceTask.REMOTE_FILE: lambda: self.get(RetraceTask.REMOTE_FILE, maxlen=1 << 22),
+            RetraceTask.MD5SUM_FILE: self.get_md5sum,
+        }
+
+        values = {}
+        for key in keys:
+            try:
+                value = getters[key]()
+            except ValueError:
+                value = None
+            values[RetraceTask.INDEXED_FILES[key]] = value
+
+        return values
+
+    def file_changed(self, key: Union[str, Path]) -> None:
+        """Propagates a change of the given file to the task index and
+        the active task registry. The setters call this, call it after
+        writing a task file directly."""
+        self.update_index(key)
+        if str(key) in [RetraceTask.LOG_FILE, RetraceTask.MANAGED_FILE]:
+            self.update_active_registry()
+
+    def update_active_registry(self) -> None:
+        """Registers the task as active (see get_active_tasks()) or removes it
+        from the active task registry according to its current state."""
+        if not CONFIG["UseActiveTaskRegistry"]:
+            return
+
+        active = not self.has_log() and not (CONFIG["AllowTaskManager"] and self.get_managed())
+        try:
+            if active:
+                add_active_task(self.get_taskid())
+            else:
+                remove_active_task(self.get_taskid())
+        except sqlite3.Error as ex:
+            log_warn("Unable to update active task registry for task %d: %s" % (self.get_taskid(), ex))
+
+    def update_index(self, key: Optional[Union[str, Path]] = None,
+                     con: Optional[sqlite3.Connection] = None) -> None:
+        """Propagates the current state of the given file to the task index.
+        Reindexes all the tracked files if key is None."""
+        if not CONFIG["UseTaskIndex"]:
+            return
+
+        if key is None:
+            keys = list(RetraceTask.INDEXED_FILES)
+        elif str(key) in RetraceTask.INDEXED_FILES:
+            keys = [str(key)]
+        else:
+            return
+
+        try:
+            update_task_index(self.get_taskid(), self._get_index_values(keys), con)
+        except sqlite3.Error as ex:
+            log_warn("Unable to update task index for task %d: %s" % (self.get_taskid(), ex))
+
+    def snapshot(self) -> TaskSnapshot:
+        """Reads all metadata files in a single pass over the task directory.
+        Use this instead of a series of has_*() and get_*() calls when
+        several values are needed."""
+        present = set()
+        contents: Dict[str, str] = {}
+        with os.scandir(self._savedir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                present.add(entry.name)
+                if entry.name in RetraceTask.COMPRESSED_FILES:
+                    present.add(RetraceTask.COMPRESSED_FILES[entry.name])
+                maxlen = RetraceTask.SNAPSHOT_FILES.get(entry.name)
+                if maxlen is None:
+                    continue
+
+                try:
+                    with open(entry.path, "r", encoding="utf-8", errors="replace") as f:
+                        contents[entry.name] = f.read(maxlen)
+                except FileNotFoundError:
+                    # removed since the directory was listed
+                    present.discard(entry.name)
+
+        if RetraceTask.MANIFEST_FILE in present:
+            manifest = self._read_manifest() or {}
+            present.update(manifest)
+            for key, value in manifest.items():
+                maxlen = RetraceTask.SNAPSHOT_FILES.get(key)
+                if maxlen is not None:
+                    contents[key] = value[:maxlen]
+
+        dirstat = self._savedir.stat()
+
+        bugzillano = contents.get(RetraceTask.BUGZILLANO_FILE, "")
+        notify = contents.get(RetraceTask.NOTIFY_FILE, "")
+        tasktype = _parse_int(contents.get(RetraceTask.TYPE_FILE))
+
+        return TaskSnapshot(taskid=self.get_taskid(),
+                            type=TASK_RETRACE if tasktype is None else tasktype,
+                            status=_parse_int(contents.get(RetraceTask.STATUS_FILE)),
+                            managed=RetraceTask.MANAGED_FILE in present,
+                            has_log=RetraceTask.LOG_FILE in present,
+                            has_backtrace=RetraceTask.BACKTRACE_FILE in present,
+                            has_mock=RetraceTask.MOCK_SITE_DEFAULTS_CFG in present,
+                            has_crashrc=RetraceTask.CRASHRC_FILE in present,
+                            caseno=_parse_int(contents.get(RetraceTask.CASENO_FILE)),
+                            bugzillano=[bz for bz in set(n.strip() for n in bugzillano.split("\n")) if bz],
+                            started_time=_parse_int(contents.get(RetraceTask.STARTED_FILE)),
+                            finished_time=_parse_int(contents.get(RetraceTask.FINISHED_FILE)),
+                            default_started_time=int(dirstat.st_ctime),
+                            default_finished_time=int(dirstat.st_mtime),
+                            downloaded=contents.get(RetraceTask.DOWNLOADED_FILE),
+                            remote=contents.get(RetraceTask.REMOTE_FILE, "").splitlines(),
+                            md5sum=contents.get(RetraceTask.MD5SUM_FILE),
+                            notify=[email for email in set(n.strip() for n in notify.split("\n")) if email],
+                            url=contents.get(RetraceTask.URL_FILE),
+                            notes=contents.get(RetraceTask.NOTES_FILE),
+                            kernelver=contents.get(RetraceTask.KERNELVER_FILE),
+                            vmlinux=contents.get(RetraceTask.VMLINUX_FILE),
+                            crash_cmd=contents.get(RetraceTask.CRASH_CMD_FILE),
+                            progress=contents.get(RetraceTask.PROGRESS_FILE))
+
+    def get_record(self) -> TaskRecord:
+        """Reads the indexed metadata directly from the task directory."""
+        snapshot = self.snapshot()
+        return TaskRecord(**{field: getattr(snapshot, field) for field in TaskRecord._fields})
 
     def get_password(self):
         """Returns task's password"""
@@ -1217,7 +2064,8 @@ class RetraceTask:
         return self.get(RetraceTask.BACKTRACE_FILE, maxlen=1 << 24)
 
     def set_backtrace(self, backtrace: str, mode: str = "w") -> None:
-        """Atomically writes given string into BACKTRACE_FILE."""
+        """Atomically writes given string into BACKTRACE_FILE
+        or appends it if mode is 'a'."""
         self.set_atomic(RetraceTask.BACKTRACE_FILE, backtrace, mode)
 
     def has_log(self) -> bool:
@@ -1231,11 +2079,10 @@ class RetraceTask:
 
     def set_log(self, log: str, append=False):
         """Atomically writes or appends given string into LOG_FILE."""
-        mode = "w"
         if append:
-            mode = "a"
-
-        self.set_atomic(RetraceTask.LOG_FILE, log, mode=mode)
+            self.append(RetraceTask.LOG_FILE, log)
+        else:
+            self.set_atomic(RetraceTask.LOG_FILE, log)
 
     def has_status(self) -> bool:
         """Verifies whether STATUS_FILE is present in the task directory."""
@@ -1258,6 +2105,12 @@ class RetraceTask:
         """Atomically writes given statuscode into STATUS_FILE."""
         self.set_atomic(RetraceTask.STATUS_FILE, "%d" % statuscode)
 
+        if CONFIG["UseWorkerRegistry"]:
+            try:
+                set_worker_phase(self.get_taskid(), statuscode)
+            except OSError as ex:
+                log_warn("Unable to update worker registry for task %d: %s" % (self.get_taskid(), ex))
+
     def has_remote(self) -> bool:
         """Verifies whether REMOTE_FILE is present in the task directory."""
         return self.has(RetraceTask.REMOTE_FILE)
@@ -1267,7 +2120,7 @@ class RetraceTask:
         if "\n" in url:
             url = url.split("\n")[0]
 
-        self.set(RetraceTask.REMOTE_FILE, "%s\n" % url, mode="a")
+        self.append(RetraceTask.REMOTE_FILE, "%s\n" % url)
 
     def get_remote(self) -> List[str]:
         """Returns the list of remote resources."""
@@ -1373,14 +2226,21 @@ class RetraceTask:
         coredump_path = self._savedir / self.COREDUMP_FILE
         return coredump_path.is_file()
 
-    def download_block(self, data: bytes) -> None:
-        self._progress_write_func(data)
-        self._progress_current += len(data)
-        progress = "%d%% (%s / %s)" % ((100 * self._progress_current) // self._progress_total,
-                                       human_readable_size(self._progress_current),
-                                       self._progress_total_str)
+    def get_progress(self) -> Optional[str]:
+        """Gets the download progress from PROGRESS_FILE"""
+        return self.get(RetraceTask.PROGRESS_FILE, maxlen=1 << 8)
+
+    def set_progress(self, progress: str) -> None:
+        """Atomically writes the download progress into PROGRESS_FILE"""
         self.set_atomic(RetraceTask.PROGRESS_FILE, progress)
 
+    def start_progress(self, total: int) -> ProgressReporter:
+        """Starts reporting progress of a download of total bytes to progress_sink."""
+        self._progress = ProgressReporter(total, self.progress_sink,
+                                          min_interval=CONFIG["ProgressUpdateInterval"],
+                                          min_bytes=CONFIG["ProgressUpdateSize"] << 20)
+        return self._progress
+
     def run_crash_cmdline(self, crash_start: List[str], crash_cmdline: str) -> Tuple[Optional[bytes], int]:
         cmd_output = None
         returncode = 0
@@ -1421,8 +2281,151 @@ class RetraceTask:
 
         return cmd_output, returncode
 
+    @staticmethod
+    def _get_unpacked_result(sink: StreamUnpacker, crashdir: Path, downloaded: str,
+                             hasher: Optional[StreamHasher]) -> RemoteResult:
+        for member in sink.skipped:
+            log_warn("Skipped archive member '%s'" % member)
+
+        main_file = sink.get_main_file()
+        if main_file is None:
+            return RemoteResult(error=(downloaded, "No files found in the archive"))
+
+        return RemoteResult(str(main_file.relative_to(crashdir)), downloaded,
+                            hasher.hexdigest() if hasher is not None else None)
+
+    def _fetch_remote(self, url: str, crashdir: Path, progress: ProgressReporter,
+                      md5: bool = False, unpack: bool = False) -> RemoteResult:
+        """Fetches a single remote resource into crashdir. If md5 is set, the data
+        is hashed on the way. If unpack is set and StreamingUnpack is enabled,
+        archives are unpacked on the way too and the result names the largest
+        unpacked file. Safe to run in parallel for resources with different
+        file names."""
+        streaming = unpack and CONFIG["StreamingUnpack"]
+
+        # download from a remote FTP
+        if url.startswith("FTP "):
+            filename = url[4:].strip()
+            log_info("Retrieving FTP file '%s'" % filename)
+
+            hasher = StreamHasher() if md5 else None
+            sink = StreamUnpacker(crashdir, filename, CONFIG["SparseFiles"]) if streaming else None
+            with FTPDownloader(progress, hasher, sink) as downloader:
+                try:
+                    downloader.download(filename, crashdir / filename)
+                except Exception as ex:
+                    return RemoteResult(error=(url, str(ex)))
+
+            if sink is not None:
+                return self._get_unpacked_result(sink, crashdir, filename, hasher)
+
+            return RemoteResult(filename, filename, hasher.hexdigest() if hasher is not None else None)
+
+        # download local file
+        if url.startswith("/") or url.startswith("file:///"):
+            if url.startswith("file://"):
+                path = Path(urllib.parse.unquote(url[7:]))
+            else:
+                path = Path(url)
+
+            log_info("Retrieving local file '%s'" % path)
+
+            if not path.is_file():
+                return RemoteResult(error=(str(path), "File not found"))
+
+            filename = path.name
+            targetfile = crashdir / filename
+
+            if streaming and get_archive_type(path) != ARCHIVE_UNKNOWN:
+                log_debug("Unpacking")
+                hasher = StreamHasher() if md5 else None
+                sink = StreamUnpacker(crashdir, filename, CONFIG["SparseFiles"])
+                try:
+                    self._unpack_local(path, sink, hasher, progress)
+                except Exception as ex:
+                    sink.abort()
+                    return RemoteResult(error=(str(path), str(ex)))
+
+                return self._get_unpacked_result(sink, crashdir, str(url), hasher)
+
+            copy = True
+            if get_archive_type(path) == ARCHIVE_UNKNOWN:
+                try:
+                    log_debug("Trying hardlink")
+                    os.link(path, targetfile)
+                    copy = False
+                    log_debug("Succeeded")
+                except OSError:
+                    log_debug("Failed")
+
+            md5v = None
+            if copy:
+                log_debug("Copying")
+                progress.expect(path.stat().st_size)
+                try:
+                    copied = copy_file(path, targetfile, md5, progress.update, CONFIG["SparseFiles"])
+                except Exception as ex:
+                    return RemoteResult(error=(str(path), str(ex)))
+
+                log_info("Copied %s in %.1f s using %s (%s/s)"
+                         % (human_readable_size(copied.size), copied.duration, copied.method,
+                            human_readable_size(copied.throughput)))
+                md5v = copied.md5sum
+            else:
+                size = targetfile.stat().st_size
+                progress.expect(size)
+                progress.update(size)
+
+            return RemoteResult(filename, str(url), md5v)
+
+        # download the remote file from HTTP(S) or FTP URL
+        log_info("Retrieving remote file '%s'" % url)
+
+        if "/" not in url or not url.rsplit("/", 1)[1]:
+            return RemoteResult(error=(url, "malformed URL"))
+
+        filename = url.rsplit("/", 1)[1]
+        hasher = StreamHasher() if md5 else None
+        sink = StreamUnpacker(crashdir, filename, CONFIG["SparseFiles"]) if streaming else None
+        with HTTPDownloader(progress, hasher, sink) as downloader:
+            try:
+                downloader.download(url, crashdir / filename)
+            except Exception as ex:
+                return RemoteResult(error=(url, str(ex)))
+
+        if sink is not None:
+            return self._get_unpacked_result(sink, crashdir, url, hasher)
+
+        return RemoteResult(filename, url, hasher.hexdigest() if hasher is not None else None)
+
+    @staticmethod
+    def _unpack_local(source: Path, sink: StreamUnpacker, hasher: Optional[StreamHasher],
+                      progress: ProgressReporter, chunk_size: int = 1 << 20) -> None:
+        """Passes the contents of source to sink, hashing them if hasher is given."""
+        progress.expect(source.stat().st_size)
+        with open(source, "rb") as source_file:
+            while True:
+                chunk = source_file.read(chunk_size)
+                if not chunk:
+                    break
+                if hasher is not None:
+                    hasher.feed(sink.position, chunk)
+                sink.write(chunk)
+                progress.update(len(chunk))
+
+        sink.close()
+
+    @staticmethod
+    def _get_remote_filename(url: str) -> str:
+        if url.startswith("FTP "):
+            return url[4:].strip()
+
+        return url.rsplit("/", 1)[-1]
+
     def download_remote(self, unpack: bool = True) -> List[Tuple[str, str]]:
-        """Downloads all remote resources and returns a list of errors."""
+        """Downloads all remote resources and returns a list of errors.
+        Up to MaxParallelDownloads resources are fetched at once, the downloaded
+        files are then post-processed one by one in the original order."""
         md5sums = []
         downloaded = []
         errors = []
@@ -1433,93 +2436,45 @@ class RetraceTask:
             crashdir.mkdir(parents=True)
             os.umask(oldmask)
 
-        for url in self.get_remote():
+        remotes = self.get_remote()
+        if remotes:
             self.set_status(STATUS_DOWNLOADING)
             log_info(STATUS[STATUS_DOWNLOADING])
 
-            # download from a remote FTP
-            if url.startswith("FTP "):
-                filename = url[4:].strip()
-                log_info("Retrieving FTP file '%s'" % filename)
-
-                ftp = None
-                try:
-                    ftp = ftp_init()
-                    with open(crashdir / filename, "wb") as target_file:
-                        self._progress_write_func = target_file.write
-                        self._progress_total = ftp.size(filename)
-                        self._progress_total_str = human_readable_size(self._progress_total)
-                        self._progress_current = 0
-
-                        # the files are expected to be huge (even hundreds of gigabytes)
-                        # use a larger buffer - 16MB by default
-                        ftp.retrbinary("RETR %s" % filename, self.download_block,
-                                       CONFIG["FTPBufferSize"] * (1 << 20))
-
-                    downloaded.append(filename)
-                except Exception as ex:
-                    errors.append((url, str(ex)))
-                    continue
-                finally:
-                    if ftp:
-                        ftp_close(ftp)
-            # download local file
-            elif url.startswith("/") or url.startswith("file:///"):
-                if url.startswith("file://"):
-                    path = Path(urllib.parse.unquote(url[7:]))
-                else:
-                    path = Path(url)
+        # a single progress for all resources, each adds its size once known
+        progress = self.start_progress(0)
 
-                log_info("Retrieving local file '%s'" % path)
+        workers = max(1, min(CONFIG["MaxParallelDownloads"], len(remotes)))
+        # resources saved under the same name would overwrite each other
+        filenames = [self._get_remote_filename(url) for url in remotes]
+        if len(set(filenames)) != len(filenames):
+            workers = 1
 
-                if not path.is_file():
-                    errors.append((str(path), "File not found"))
-                    continue
+        # hash the data on the fly rather than reading the files again later
+        md5 = self.has_md5sum()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda url: self._fetch_remote(url, crashdir, progress, md5, unpack),
+                                        remotes))
 
-                filename = path.name
-                targetfile = crashdir / filename
+        if remotes:
+            progress.finish()
 
-                copy = True
-                if get_archive_type(path) == ARCHIVE_UNKNOWN:
-                    try:
-                        log_debug("Trying hardlink")
-                        os.link(path, targetfile)
-                        copy = False
-                        log_debug("Succeeded")
-                    except OSError:
-                        log_debug("Failed")
-
-                if copy:
-                    try:
-                        log_debug("Copying")
-                        shutil.copy(path, targetfile)
-                    except Exception as ex:
-                        errors.append((str(path), str(ex)))
-                        continue
-
-                downloaded.append(str(url))
-            # use wget to download the remote file
-            else:
-                log_info("Retrieving remote file '%s'" % url)
-
-                if "/" not in url:
-                    errors.append((url, "malformed URL"))
-                    continue
-
-                child = run(["wget", "-nv", "-P", str(crashdir), url],
-                            stdout=PIPE, stderr=STDOUT, encoding='utf-8', check=False)
-                stdout = child.stdout
-                if child.returncode:
-                    errors.append((url, "wget exited with %d: %s" % (child.returncode, stdout)))
-                    continue
-
-                filename = url.rsplit("/", 1)[1]
-                downloaded.append(url)
+        for result in results:
+            if result.error is not None:
+                errors.append(result.error)
+                continue
 
-            if self.has_md5sum():
-                self.set_status(STATUS_CALCULATING_MD5SUM)
-                log_info(STATUS[STATUS_CALCULATING_MD5SUM])
-                md5v = self.calculate_md5(crashdir / filename)
+            assert result.filename is not None and result.downloaded is not None
+            filename = result.filename
+            downloaded.append(result.downloaded)
+
+            if md5:
+                md5v = result.md5sum
+                if md5v is None:
+                    # hardlinked or reflinked, the data has not passed through
+                    self.set_status(STATUS_CALCULATING_MD5SUM)
+                    log_info(STATUS[STATUS_CALCULATING_MD5SUM])
+                    md5v = self.calculate_md5(crashdir / filename)
                 md5sums.append("{0} {1}".format(md5v, downloaded[-1]))
                 self.set_md5sum("\n".join(md5sums)+"\n")
 
@@ -1635,10 +2590,9 @@ class RetraceTask:
                 file_path.unlink()
 
             if coredump.is_file():
-                oldsize = coredump.stat().st_size
-                log_info("Coredump size: %s" % human_readable_size(oldsize))
-
                 st = coredump.stat()
+                log_info("Coredump size: %s" % human_readable_file_size(st))
+
                 if (st.st_mode & stat.S_IRGRP) == 0:
                     try:
                         coredump.chmod(st.st_mode | stat.S_IRGRP)
@@ -1648,7 +2602,14 @@ class RetraceTask:
                                  " it fails this is the likely cause."
                                  % coredump)
 
-        (self._savedir / RetraceTask.REMOTE_FILE).unlink()
+        if unpack and CONFIG["UseTreeHash"]:
+            log_info("Calculating tree hash")
+            try:
+                self.update_tree_hash()
+            except OSError as ex:
+                log_warn("Unable to calculate tree hash: %s" % ex)
+
+        self.delete(RetraceTask.REMOTE_FILE)
         self.set_downloaded(", ".join(downloaded))
 
         return errors
@@ -1762,6 +2723,102 @@ class RetraceTask:
         """Writes (not atomically) content to MD5SUM_FILE"""
         self.set(RetraceTask.MD5SUM_FILE, value)
 
+    def get_core_path(self) -> Path:
+        """Returns the path to the vmcore or the coredump, depending on task type."""
+        if self.get_type() in [TASK_VMCORE, TASK_VMCORE_INTERACTIVE]:
+            self.find_vmcore_file()
+            return self.get_vmcore_path()
+
+        return self.get_crashdir() / RetraceTask.COREDUMP_FILE
+
+    def get_tree_hash(self) -> Optional[Dict[str, Any]]:
+        """Gets the tree hash of the core file from TREE_HASH_FILE,
+        see retrace.treehash. It may be outdated, see update_tree_hash()."""
+        value = self.get(RetraceTask.TREE_HASH_FILE, maxlen=1 << 24)
+        if value is None:
+            return None
+
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def set_tree_hash(self, tree: Dict[str, Any]) -> None:
+        """Atomically writes the tree hash into TREE_HASH_FILE"""
+        self.set_atomic(RetraceTask.TREE_HASH_FILE, json.dumps(tree))
+
+    def update_tree_hash(self) -> Optional[Dict[str, Any]]:
+        """Returns the tree hash of the core file, computing it only if
+        the file has changed since it was stored. None if there is no core file."""
+        core_path = self.get_core_path()
+        if not core_path.is_file():
+            return None
+
+        previous = self.get_tree_hash()
+        tree = compute_tree_hash(core_path, previous)
+        if tree is not previous:
+            self.set_tree_hash(tree)
+
+        return tree
+
+    def verify_core_file(self, count: int) -> List[int]:
+        """Re-reads count randomly chosen chunks of the core file and returns indices
+        of those that no longer match the stored tree hash. Nothing is checked
+        if the tree hash is missing or the file has been modified since."""
+        core_path = self.get_core_path()
+        tree = self.get_tree_hash()
+        if tree is None or not is_tree_hash_current(tree, core_path):
+            return []
+
+        chunks = random.sample(range(len(tree["chunks"])), min(count, len(tree["chunks"])))
+        return verify_tree_hash(core_path, tree, sorted(chunks))
+
+    def get_dedup_key(self) -> Optional[str]:
+        """Returns a string identifying the contents of the core file,
+        tasks with the same key may share it (see dedup_vmcore()).
+        The root of the tree hash if UseTreeHash is enabled, md5sum otherwise."""
+        if CONFIG["UseTreeHash"]:
+            tree = self.update_tree_hash()
+            if tree is None:
+                return None
+            return "%s:%s" % (tree["algorithm"], tree["root"])
+
+        md5sum = self.get_md5sum()
+        if not md5sum or not MD5_PARSER.search(md5sum.split()[0]):
+            return None
+        return "md5:%s" % md5sum.split()[0]
+
+    def sparsify_core_file(self) -> int:
+        """Punches holes into the core file where it contains blocks of zeros,
+        unless it already has holes, i.e. it has been written sparse, or it
+        has other hardlinks, e.g. to the original of a local remote file.
+        Returns the number of bytes deallocated."""
+        core_path = self.get_core_path()
+        if not core_path.is_file():
+            return 0
+
+        st = core_path.stat()
+        if st.st_nlink > 1 or is_sparse(st):
+            return 0
+
+        return sparsify_file(core_path)
+
+    def store_core_file(self) -> int:
+        """Moves the core file into the object store keyed by its tree hash, see
+        retrace.objectstore. A core file identical to one stored before is replaced
+        by a hardlink to it. Returns the number of bytes released that way."""
+        core_path = self.get_core_path()
+        tree = self.update_tree_hash()
+        if tree is None:
+            return 0
+
+        stored = store_file(core_path, "%s-%s" % (tree["algorithm"], tree["root"]))
+        if stored.saved:
+            # same contents, only the modification time of the object differs
+            self.set_tree_hash(dict(tree, mtime_ns=core_path.stat().st_mtime_ns))
+
+        return stored.saved
+
     def has_crashrc(self) -> bool:
         """Verifies whether CRASHRC_FILE exists"""
         return self.has(RetraceTask.CRASHRC_FILE)
@@ -1906,17 +2963,25 @@ class RetraceTask:
         if not self._savedir.is_dir():
             return
 
+        keep = [RetraceTask.REMOTE_FILE, RetraceTask.CASENO_FILE,
+                RetraceTask.BACKTRACE_FILE, RetraceTask.DOWNLOADED_FILE,
+                RetraceTask.FINISHED_FILE, RetraceTask.LOG_FILE,
+                RetraceTask.MANAGED_FILE, RetraceTask.NOTES_FILE,
+                RetraceTask.NOTIFY_FILE, RetraceTask.PASSWORD_FILE,
+                RetraceTask.STARTED_FILE, RetraceTask.STATUS_FILE,
+                RetraceTask.TYPE_FILE, RetraceTask.RESULTS_DIR,
+                RetraceTask.CRASHRC_FILE, RetraceTask.CRASH_CMD_FILE,
+                RetraceTask.URL_FILE, RetraceTask.MOCK_LOG_DIR,
+                RetraceTask.VMLINUX_FILE, RetraceTask.BUGZILLANO_FILE,
+                RetraceTask.MANIFEST_FILE]
+        keep.extend(RetraceTask.COMPRESSED_FILES)
+
+        manifest = self._read_manifest()
+        if manifest is not None:
+            self._update_manifest({key: None for key in manifest if key not in keep})
+
         for f in self._savedir.iterdir():
-            if f.name in [RetraceTask.REMOTE_FILE, RetraceTask.CASENO_FILE,
-                          RetraceTask.BACKTRACE_FILE, RetraceTask.DOWNLOADED_FILE,
-                          RetraceTask.FINISHED_FILE, RetraceTask.LOG_FILE,
-                          RetraceTask.MANAGED_FILE, RetraceTask.NOTES_FILE,
-                          RetraceTask.NOTIFY_FILE, RetraceTask.PASSWORD_FILE,
-                          RetraceTask.STARTED_FILE, RetraceTask.STATUS_FILE,
-                          RetraceTask.TYPE_FILE, RetraceTask.RESULTS_DIR,
-                          RetraceTask.CRASHRC_FILE, RetraceTask.CRASH_CMD_FILE,
-                          RetraceTask.URL_FILE, RetraceTask.MOCK_LOG_DIR,
-                          RetraceTask.VMLINUX_FILE, RetraceTask.BUGZILLANO_FILE]:
+            if f.name in keep:
                 continue
 
             try:
@@ -1929,6 +2994,8 @@ class RetraceTask:
                 # ToDo advanced handling
                 pass
 
+        self.update_index()
+
     def reset(self):
         """Remove all generated files and only keep the raw crash data"""
         # Delete logs if there are any.
@@ -1937,36 +3004,57 @@ class RetraceTask:
             shutil.rmtree(logs_dir)
 
         # Delete the remaining files.
-        for filename in [RetraceTask.BACKTRACE_FILE, RetraceTask.CRASHRC_FILE,
-                         RetraceTask.FINISHED_FILE, RetraceTask.LOG_FILE,
-                         RetraceTask.PROGRESS_FILE, RetraceTask.STARTED_FILE,
-                         RetraceTask.STATUS_FILE, RetraceTask.MOCK_DEFAULT_CFG,
-                         RetraceTask.MOCK_SITE_DEFAULTS_CFG, RetraceTask.MOCK_LOGGING_INI,
-                         RetraceTask.CRASH_CMD_FILE, RetraceTask.VMLINUX_FILE]:
+        generated = [RetraceTask.BACKTRACE_FILE, RetraceTask.CRASHRC_FILE,
+                     RetraceTask.FINISHED_FILE, RetraceTask.LOG_FILE,
+                     RetraceTask.PROGRESS_FILE, RetraceTask.STARTED_FILE,
+                     RetraceTask.STATUS_FILE, RetraceTask.MOCK_DEFAULT_CFG,
+                     RetraceTask.MOCK_SITE_DEFAULTS_CFG, RetraceTask.MOCK_LOGGING_INI,
+                     RetraceTask.CRASH_CMD_FILE, RetraceTask.VMLINUX_FILE]
+
+        if self.has_manifest():
+            self._update_manifest({key: None for key in generated if key in RetraceTask.MANIFEST_KEYS})
+
+        for filename in generated:
             try:
                 (self._savedir / filename).unlink()
             except OSError as ex:
                 # ignore 'No such file or directory'
                 if ex.errno != errno.ENOENT:
                     raise
+            self._remove_compressed(filename)
 
         results_dir = self.get_results_dir()
         for filename in Path(results_dir).iterdir():
             filename.unlink()
 
-        kerneldir = Path(CONFIG["SaveDir"], "%d-kernel" % self._taskid)
+        kerneldir = self.get_kernel_dir()
         if kerneldir.is_dir():
             shutil.rmtree(kerneldir)
 
+        self.update_index()
+        self.update_active_registry()
+
     def remove(self) -> None:
         """Completely removes the task directory."""
         self.clean()
-        kerneldir = Path(CONFIG["SaveDir"], "%d-kernel" % self._taskid)
+        kerneldir = self.get_kernel_dir()
         if kerneldir.is_dir():
             shutil.rmtree(kerneldir)
 
         shutil.rmtree(self._savedir)
 
+        if CONFIG["UseTaskIndex"]:
+            try:
+                delete_task_index(self.get_taskid())
+            except sqlite3.Error as ex:
+                log_warn("Unable to remove task %d from task index: %s" % (self.get_taskid(), ex))
+
+        if CONFIG["UseActiveTaskRegistry"]:
+            try:
+                remove_active_task(self.get_taskid())
+            except sqlite3.Error as ex:
+                log_warn("Unable to remove task %d from active task registry: %s" % (self.get_taskid(), ex))
+
     def create_worker(self):
         """Get default worker instance for this task"""
         # TODO: let it be configurable
@@ -1974,38 +3062,87 @@ class RetraceTask:
         return RetraceWorker(self)
 
 
-def get_md5_tasks() -> List[RetraceTask]:
-    tasks = []
+def get_task_ids(use_index: bool = True) -> List[int]:
+    """Returns sorted IDs of all tasks in SaveDir."""
+    if use_index:
+        records = query_task_indexer()
+        if records is not None:
+            return [record.taskid for record in records]
 
-    for filename in Path(CONFIG["SaveDir"]).iterdir():
-        if len(filename.name) != CONFIG["TaskIdLength"]:
-            continue
+    if use_index and CONFIG["UseTaskIndex"]:
+        try:
+            return [record.taskid for record in query_task_index()]
+        except sqlite3.Error as ex:
+            log_warn("Unable to query task index, scanning %s: %s" % (CONFIG["SaveDir"], ex))
+
+    return sorted(int(taskdir.name) for taskdir in scan_task_dirs())
+
+
+def get_task_records(**filters: Any) -> List[TaskRecord]:
+    """Returns metadata of all tasks matching the filters. Each filter is
+    a TaskRecord field with either a single value or a list of allowed values.
+    Asks retrace-server-indexer or the task index if enabled, reads the task
+    directories otherwise."""
+    records = query_task_indexer(**filters)
+    if records is not None:
+        return records
 
+    if CONFIG["UseTaskIndex"]:
         try:
-            task = RetraceTask(int(filename.name))
+            return query_task_index(**filters)
+        except sqlite3.Error as ex:
+            log_warn("Unable to query task index, scanning %s: %s" % (CONFIG["SaveDir"], ex))
+
+    records = []
+    for taskid in get_task_ids():
+        try:
+            records.append(RetraceTask(taskid).get_record())
         except Exception:
             continue
 
-        if not task.has_status():
+    return filter_task_records(records, **filters)
+
+
+def get_md5_tasks() -> List[RetraceTask]:
+    tasks = []
+
+    for record in get_task_records(status=[STATUS_SUCCESS, STATUS_FAIL]):
+        if record.finished_time is None or not record.md5sum:
             continue
-        status = task.get_status()
 
-        if status not in (STATUS_SUCCESS, STATUS_FAIL):
+        if not MD5_PARSER.search(record.md5sum.split()[0]):
             continue
 
-        if not task.has_finished_time():
+        try:
+            task = RetraceTask(record.taskid)
+        except Exception:
             continue
 
         if not task.has_vmcore() and not task.has_coredump():
             continue
 
-        if not task.has_md5sum():
+        tasks.append(task)
+
+    return tasks
+
+
+def get_dedup_tasks() -> List[RetraceTask]:
+    """Returns finished tasks whose core files may be shared with other tasks,
+    see RetraceTask.get_dedup_key(). With UseTreeHash these do not need md5sum."""
+    if not CONFIG["UseTreeHash"]:
+        return get_md5_tasks()
+
+    tasks = []
+    for record in get_task_records(status=[STATUS_SUCCESS, STATUS_FAIL]):
+        if record.finished_time is None:
             continue
 
-        md5sum = task.get_md5sum()
-        # Assured by task.has_md5sum() returning True above.
-        assert isinstance(md5sum, str)
-        if not MD5_PARSER.search(md5sum.split()[0]):
+        try:
+            task = RetraceTask(record.taskid)
+        except Exception:
+            continue
+
+        if not task.has_vmcore() and not task.has_coredump():
             continue
 
         tasks.append(task)
@@ -2071,6 +3208,13 @@ class KernelVMcore:
                       (self._vmcore_path, e.errno, e.strerror))
             return False
 
+        # makedumpfile -R writes the zero pages out
+        if CONFIG["SparseFiles"]:
+            try:
+                sparsify_file(self._vmcore_path)
+            except OSError as ex:
+                log_warn("Unable to punch holes into %s: %s" % (self._vmcore_path, ex))
+
         self._is_flattened_format = False
         return True
 
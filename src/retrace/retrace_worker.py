@@ -20,7 +20,7 @@ from .retrace import (ALLOWED_FILES, EXPLOITABLE_SEPARATOR, PYTHON_LABEL_END,
                       STATUS_FAIL, STATUS_INIT, STATUS_STATS, STATUS_SUCCESS,
                       TASK_DEBUG, TASK_RETRACE, TASK_RETRACE_INTERACTIVE, TASK_VMCORE,
                       TASK_VMCORE_INTERACTIVE, RETRACE_GPG_KEYS, SNAPSHOT_SUFFIXES,
-                      get_active_tasks,
+                      count_active_tasks,
                       get_supported_releases,
                       guess_arch,
                       is_package_known,
@@ -38,12 +38,14 @@ from .retrace import (ALLOWED_FILES, EXPLOITABLE_SEPARATOR, PYTHON_LABEL_END,
                       RetraceWorkerError)
 from .config import Config, PODMAN_BIN
 from .plugins import Plugins
+from .sparse import get_allocated_size
 from .stats import (init_crashstats_db,
                     save_crashstats,
                     save_crashstats_build_ids,
                     save_crashstats_packages,
                     save_crashstats_success)
 from .util import (INPUT_PACKAGE_PARSER,
+                   human_readable_file_size,
                    human_readable_size,
                    parse_rpm_name,
                    send_email)
@@ -67,6 +69,8 @@ class RetraceWorker:
         if self.logging_handler is None:
             self.logging_handler = logging.FileHandler(
                 self.task._get_file_path(RetraceTask.LOG_FILE))
+            # the log file marks the task as no longer waiting
+            self.task.file_changed(RetraceTask.LOG_FILE)
 
         formatter = logging.Formatter(fmt="[%(asctime)s] [%(levelname)-.1s] %(message)s",
                                       datefmt="%Y-%m-%d %H:%M:%S")
@@ -78,74 +82,70 @@ class RetraceWorker:
             logger.removeHandler(self.logging_handler)
 
     def notify_email(self) -> None:
+        if not CONFIG["EmailNotify"]:
+            return
+
         task = self.task
-        if not CONFIG["EmailNotify"] or not task.has_notify():
+        snapshot = task.snapshot()
+        if not snapshot.notify:
             return
-        if task.get_status() == STATUS_SUCCESS:
+
+        if snapshot.status == STATUS_SUCCESS:
             disposition = "succeeded"
         else:
             disposition = "failed"
 
         try:
-            log_info("Sending e-mail to %s" % ", ".join(task.get_notify()))
+            log_info("Sending e-mail to %s" % ", ".join(snapshot.notify))
 
-            message = "The task #%d started on %s %s\n\n" % (task.get_taskid(), os.uname()[1], disposition)
+            message = "The task #%d started on %s %s\n\n" % (snapshot.taskid, os.uname()[1], disposition)
 
-            if task.has_url():
-                message += "URL: %s\n" % task.get_url()
+            if snapshot.url is not None:
+                message += "URL: %s\n" % snapshot.url
 
             message += "Task directory: %s\n" % task.get_savedir()
 
-            if task.has_started_time():
-                started_time = task.get_started_time()
-                assert isinstance(started_time, int)
-                message += "Started: %s\n" % datetime.datetime.fromtimestamp(started_time)
+            if snapshot.started_time is not None:
+                message += "Started: %s\n" % datetime.datetime.fromtimestamp(snapshot.started_time)
 
-            if task.has_finished_time():
-                finished_time = task.get_finished_time()
-                assert isinstance(finished_time, int)
-                message += "Finished: %s\n" % datetime.datetime.fromtimestamp(finished_time)
+            if snapshot.finished_time is not None:
+                message += "Finished: %s\n" % datetime.datetime.fromtimestamp(snapshot.finished_time)
 
-            if task.has_md5sum():
-                message += "MD5sum: %s" % task.get_md5sum()
+            if snapshot.md5sum is not None:
+                message += "MD5sum: %s" % snapshot.md5sum
 
-            if task.has_kernelver():
-                message += "Kernelver: %s\n" % task.get_kernelver()
+            if snapshot.kernelver is not None:
+                message += "Kernelver: %s\n" % snapshot.kernelver
 
-            if task.has_remote() or task.has_downloaded():
-                files = ""
-                if task.has_remote():
-                    remote = [x[4:] if x.startswith("FTP ") else x for x in task.get_remote()]
-                    files = ", ".join(remote)
-
-                if task.has_downloaded():
-                    files = ", ".join(filter(None, [task.get_downloaded(), files]))
+            if snapshot.remote or snapshot.downloaded is not None:
+                remote = [x[4:] if x.startswith("FTP ") else x for x in snapshot.remote]
+                files = ", ".join(filter(None, [snapshot.downloaded, ", ".join(remote)]))
 
                 message += "Remote file(s): %s\n" % files
 
-            if task.get_type() in [TASK_VMCORE, TASK_VMCORE_INTERACTIVE] and task.get_status() == STATUS_FAIL:
+            if snapshot.type in [TASK_VMCORE, TASK_VMCORE_INTERACTIVE] and snapshot.status == STATUS_FAIL:
                 message += "\nIf kernel version detection failed (the log shows 'Unable to determine kernel " \
                            "version'), and you know the kernel version, you may try re-starting the task " \
                            "with the 'retrace-server-task restart' command.  Please check the log below " \
                            "for more information on why the task failed.  The following example assumes " \
                            "the vmcore's kernel version is 2.6.32-358.el6 on x86_64 arch: \n" \
                            "$ retrace-server-task restart --kernelver 2.6.32-358.el6.x86_64 %d\n" \
-                           % task.get_taskid()
+                           % snapshot.taskid
                 message += "\nIf this is a test kernel with a non-errata kernel version, or for some reason " \
                            "the kernel-debuginfo repository is unavailable, you can place the kernel-debuginfo RPM " \
                            "at %s/download/ and restart the task with: \n$ retrace-server-task restart %d\n" \
-                           % (CONFIG["RepoDir"], task.get_taskid())
+                           % (CONFIG["RepoDir"], snapshot.taskid)
                 message += "\nIf the retrace-log contains a message similar to 'Failing task due to crash " \
                            "exiting with non-zero status and small kernellog size' then the vmcore may be " \
                            "truncated or incomplete and not useable.  Check the md5sum on the manager page " \
                            "and compare with the expected value, and possibly re-upload and resubmit the vmcore.\n"
 
-            if task.has_log():
+            if snapshot.has_log:
                 message += "\nLog:\n%s\n" % task.get_log()
 
             send_email("Retrace Server <%s>" % CONFIG["EmailNotifyFrom"],
-                       task.get_notify(),
-                       "Retrace Task #%d on %s %s" % (task.get_taskid(), os.uname()[1], disposition),
+                       snapshot.notify,
+                       "Retrace Task #%d on %s %s" % (snapshot.taskid, os.uname()[1], disposition),
                        message)
 
         except Exception as ex:
@@ -528,7 +528,9 @@ class RetraceWorker:
         corepath = crashdir / RetraceTask.COREDUMP_FILE
         debuginfod_enabled = self.task.get_debuginfod_enabled()
         try:
-            self.stats["coresize"] = corepath.stat().st_size
+            st = corepath.stat()
+            self.stats["coresize"] = st.st_size
+            self.stats["coreallocated"] = get_allocated_size(st)
         except OSError:
             pass
 
@@ -693,7 +695,7 @@ class RetraceWorker:
         try:
             con = init_crashstats_db()
             statsid = save_crashstats(self.stats, con)
-            save_crashstats_success(statsid, self.prerunning, len(get_active_tasks()),
+            save_crashstats_success(statsid, self.prerunning, count_active_tasks(),
                                     rootsize, con)
             save_crashstats_packages(statsid, packages[1:], con)
             if missing:
@@ -731,13 +733,13 @@ class RetraceWorker:
             log_warn("Attempt to dedup %s and %s but sizes differ - size1 = %d size2 = %d"
                      % (v1, v2, s1.st_size, s2.st_size))
             return 0
-        v1_md5 = str.split(task1.get_md5sum())[0]
-        v2_md5 = str.split(task2.get_md5sum())[0]
-        if len(v1_md5) != 32 or len(v2_md5) != 32:
+        v1_key = task1.get_dedup_key()
+        v2_key = task2.get_dedup_key()
+        if v1_key is None or v2_key is None:
             return 0
-        if v1_md5 != v2_md5:
-            log_warn("Attempted to dedup %s and %s but md5sums are different - v1 = %s v2 = %s)"
-                     % (v1, v2, v1_md5, v2_md5))
+        if v1_key != v2_key:
+            log_warn("Attempted to dedup %s and %s but the hashes are different - v1 = %s v2 = %s)"
+                     % (v1, v2, v1_key, v2_key))
             return 0
 
         v2_link = v2.parent / (v2.name + "-link")
@@ -758,6 +760,11 @@ class RetraceWorker:
             log_error("ERROR: Failed to dedup %s and %s - rename hardlink %s to %s failed" % (v1, v2, v2_link, v2))
             return 0
 
+        # the file now has the size and modification time of v1
+        tree = task1.get_tree_hash()
+        if tree is not None:
+            task2.set_tree_hash(tree)
+
         log_warn("Successful dedup - created hardlink from %s to %s saving %d MB"
                  % (v2, v1, s1.st_size // 1024 // 1024))
 
@@ -775,13 +782,15 @@ class RetraceWorker:
         log_debug("Task vmcore path: %s" % task.get_vmcore_path())
 
         try:
-            self.stats["coresize"] = vmcore_path.stat().st_size
+            st = vmcore_path.stat()
+            self.stats["coresize"] = st.st_size
+            self.stats["coreallocated"] = get_allocated_size(st)
         except OSError:
             pass
 
         vmcore = KernelVMcore(vmcore_path)
         oldsize = vmcore_path.stat().st_size
-        log_info("Vmcore size: %s" % human_readable_size(oldsize))
+        log_info("Vmcore size: %s" % human_readable_file_size(vmcore_path.stat()))
         if vmcore.is_flattened_format():
             start = time.time()
             log_info("Executing makedumpfile to convert flattened format")
@@ -789,7 +798,7 @@ class RetraceWorker:
             vmcore.convert_flattened_format()
             dur = int(time.time() - start)
             newsize = vmcore_path.stat().st_size
-            log_info("Converted size: %s" % human_readable_size(newsize))
+            log_info("Converted size: %s" % human_readable_file_size(vmcore_path.stat()))
             log_info("Makedumpfile took %d seconds and saved %s"
                      % (dur, human_readable_size(oldsize - newsize)))
             oldsize = newsize
@@ -824,7 +833,7 @@ class RetraceWorker:
             # if a non-retrace user in group mock executes
             # setgid /usr/bin/mock, he gets permission denied.
             # this is not a security thing - using mock gives you root anyway
-            cfgdir = Path(CONFIG["SaveDir"], "%d-kernel" % task.get_taskid())
+            cfgdir = task.get_kernel_dir()
 
             # if the directory exists, it is orphaned - nuke it
             if cfgdir.is_dir():
@@ -1007,7 +1016,7 @@ class RetraceWorker:
             vmcore.strip_extra_pages()
             dur = int(time.time() - start)
             newsize = vmcore_path.stat().st_size
-            log_info("Stripped size: %s" % human_readable_size(newsize))
+            log_info("Stripped size: %s" % human_readable_file_size(vmcore_path.stat()))
             log_info("Makedumpfile took %d seconds and saved %s"
                      % (dur, human_readable_size(oldsize - newsize)))
 
@@ -1095,9 +1104,10 @@ class RetraceWorker:
             "starttime": int(time.time()),
             "duration": None,
             "coresize": None,
+            "coreallocated": None,
             "status": STATUS_FAIL,
         }
-        self.prerunning = len(get_active_tasks()) - 1
+        self.prerunning = count_active_tasks() - 1
         try:
             task = self.task
 
@@ -1130,6 +1140,27 @@ class RetraceWorker:
                 if not self._check_required_file(required_file, crashdir):
                     raise Exception("Crash directory does not contain required file '%s'" % required_file)
 
+            if CONFIG["SparseFiles"]:
+                try:
+                    released = task.sparsify_core_file()
+                except OSError as ex:
+                    log_warn("Unable to punch holes into the core file: %s" % ex)
+                else:
+                    if released:
+                        log_info("Punching holes into blocks of zeros of the core file saved %s"
+                                 % human_readable_size(released))
+
+            if CONFIG["UseObjectStore"]:
+                log_info("Storing the core file in the object store")
+                try:
+                    saved = task.store_core_file()
+                except Exception as ex:
+                    log_warn("Unable to store the core file: %s" % ex)
+                else:
+                    if saved:
+                        log_info("The core file has been stored before, hardlinking it saved %s"
+                                 % human_readable_size(saved))
+
             if tasktype in [TASK_RETRACE, TASK_DEBUG, TASK_RETRACE_INTERACTIVE]:
                 self.start_retrace(custom_arch=arch)
             elif tasktype in [TASK_VMCORE, TASK_VMCORE_INTERACTIVE]:
@@ -0,0 +1,174 @@
+import ctypes
+import ctypes.util
+import errno
+import functools
+import os
+from pathlib import Path
+from typing import IO, Any
+
+# runs of zeros are detected at this granularity, the usual file system block size
+SPARSE_BLOCK_SIZE = 4096
+ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+READ_SIZE = 1 << 20
+
+# from linux/falloc.h
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# the file system cannot punch holes, the file is left as it is
+UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_fallocate() -> Any:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fallocate = libc.fallocate
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+
+    return fallocate
+
+
+def punch_hole(fd: int, offset: int, length: int) -> None:
+    """Deallocates length bytes at offset, which then read as zeros. The size of the file is kept."""
+    if _get_fallocate()(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def get_allocated_size(st: os.stat_result) -> int:
+    """Returns the disk space taken by the file, less than its size if it has holes."""
+    return st.st_blocks * 512
+
+
+def is_sparse(st: os.stat_result) -> bool:
+    return get_allocated_size(st) < st.st_size
+
+
+class SparseWriter:
+    """Writes to fileobj like fileobj.write() but seeks over aligned blocks
+    of zeros instead of writing them, so that they become holes. A block
+    may be split among several write() calls. finish() must be called after
+    the last write() to write out the last block and extend the file over
+    trailing zeros."""
+
+    def __init__(self, fileobj: IO[bytes]) -> None:
+        self.fileobj = fileobj
+        # bytes passed to write() so far, counted from the start of the file
+        self.position = fileobj.tell()
+        # where fileobj stands, the data after it is kept in _pending
+        self._flushed = self.position
+        # the start of a block not complete yet
+        self._pending = b""
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        size = len(view)
+        if self._pending:
+            # complete the block started by an earlier write()
+            block_left = SPARSE_BLOCK_SIZE - self._flushed % SPARSE_BLOCK_SIZE
+            need = block_left - len(self._pending)
+            self._pending += view[:need]
+            view = view[need:]
+            self.position += size - len(view)
+            if len(self._pending) < block_left:
+                return size
+
+            self._write_blocks(memoryview(self._pending))
+            self._pending = b""
+
+        # keep the part of the last block the data does not complete
+        end = self._flushed + len(view)
+        keep = min(len(view), end % SPARSE_BLOCK_SIZE)
+        self._write_blocks(view[:len(view) - keep])
+        self._pending = bytes(view[len(view) - keep:])
+        self.position += len(view)
+        return size
+
+    def _write_blocks(self, view: memoryview) -> None:
+        # the run of blocks of the same kind not written yet
+        start = 0
+        zeros = False
+        offset = 0
+        while offset < len(view):
+            # blocks are aligned to the offset in the file
+            end = min(len(view), offset + SPARSE_BLOCK_SIZE - (self._flushed + offset) % SPARSE_BLOCK_SIZE)
+            block_zeros = end - offset == SPARSE_BLOCK_SIZE and view[offset:end] == ZERO_BLOCK
+            if block_zeros != zeros and offset > start:
+                self._write_run(view[start:offset], zeros)
+                start = offset
+            zeros = block_zeros
+            offset = end
+
+        self._write_run(view[start:], zeros)
+        self._flushed += len(view)
+
+    def _write_run(self, run: memoryview, zeros: bool) -> None:
+        if zeros:
+            self.fileobj.seek(len(run), os.SEEK_CUR)
+        elif run:
+            self.fileobj.write(run)
+
+    def finish(self) -> None:
+        self._write_blocks(memoryview(self._pending))
+        self._pending = b""
+        self.fileobj.truncate(self.position)
+
+
+def copy_sparse(source: IO[bytes], target: IO[bytes], length: int = READ_SIZE) -> None:
+    """Like shutil.copyfileobj() but leaves holes in target for blocks of zeros."""
+    writer = SparseWriter(target)
+    while True:
+        chunk = source.read(length)
+        if not chunk:
+            break
+        writer.write(chunk)
+
+    writer.finish()
+
+
+def sparsify_file(path: Path) -> int:
+    """Punches holes into path where it contains aligned blocks of zeros.
+    Existing holes are skipped. Returns the number of bytes deallocated,
+    0 if the file system does not support punching holes."""
+    before = get_allocated_size(path.stat())
+    fd = os.open(path, os.O_RDWR)
+    try:
+        offset = 0
+        while True:
+            try:
+                offset = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as ex:
+                if ex.errno == errno.ENXIO:
+                    # no data after offset
+                    break
+                raise
+            data_end = os.lseek(fd, offset, os.SEEK_HOLE)
+            offset -= offset % SPARSE_BLOCK_SIZE
+
+            hole_start = None
+            while offset < data_end:
+                chunk = os.pread(fd, min(READ_SIZE, data_end - offset), offset)
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                for start in range(0, len(view), SPARSE_BLOCK_SIZE):
+                    if view[start:start + SPARSE_BLOCK_SIZE] == ZERO_BLOCK:
+                        if hole_start is None:
+                            hole_start = offset + start
+                    elif hole_start is not None:
+                        punch_hole(fd, hole_start, offset + start - hole_start)
+                        hole_start = None
+                offset += len(view)
+
+            if hole_start is not None and offset > hole_start:
+                punch_hole(fd, hole_start, offset - hole_start)
+            offset = max(offset, data_end)
+    except OSError as ex:
+        if ex.errno not in UNSUPPORTED_ERRNOS:
+            raise
+        return 0
+    finally:
+        os.close(fd)
+
+    return max(0, before - get_allocated_size(path.stat()))
@@ -18,8 +18,13 @@ def init_crashstats_db() -> sqlite3.Connection:
     query.execute("""
       CREATE TABLE IF NOT EXISTS
       tasks(id INTEGER PRIMARY KEY AUTOINCREMENT, taskid, package, version,
-      arch, starttime NOT NULL, duration NOT NULL, coresize, status NOT NULL)
+      arch, starttime NOT NULL, duration NOT NULL, coresize, status NOT NULL,
+      coreallocated)
     """)
+    # databases created before the disk space taken by sparse core files was tracked
+    columns = [row[1] for row in query.execute("PRAGMA table_info(tasks)")]
+    if "coreallocated" not in columns:
+        query.execute("ALTER TABLE tasks ADD COLUMN coreallocated")
     query.execute("""
       CREATE TABLE IF NOT EXISTS
       success(taskid REFERENCES tasks(id), pre NOT NULL, post NOT NULL,
@@ -57,12 +62,12 @@ def save_crashstats(stats: Dict[str, Any], con: Optional[sqlite3.Connection] = N
     query = con.cursor()
     query.execute("""
       INSERT INTO tasks (taskid, package, version, arch,
-      starttime, duration, coresize, status)
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+      starttime, duration, coresize, status, coreallocated)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
       """,
                   (stats["taskid"], stats["package"], stats["version"],
                    stats["arch"], stats["starttime"], stats["duration"],
-                   stats["coresize"], stats["status"]))
+                   stats["coresize"], stats["status"], stats.get("coreallocated")))
 
     con.commit()
     if close:
@@ -0,0 +1,186 @@
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional
+
+from .config import Config
+
+CONFIG = Config()
+
+# column name: SQL type
+TASK_INDEX_COLUMNS = {
+    "type": "INTEGER",
+    "status": "INTEGER",
+    "managed": "INTEGER NOT NULL DEFAULT 0",
+    "has_log": "INTEGER NOT NULL DEFAULT 0",
+    "caseno": "INTEGER",
+    "bugzillano": "TEXT",
+    "started_time": "INTEGER",
+    "finished_time": "INTEGER",
+    "downloaded": "TEXT",
+    "remote": "TEXT",
+    "md5sum": "TEXT",
+}
+
+
+class TaskRecord(NamedTuple):
+    """Metadata of a single task as stored in the task index."""
+    taskid: int
+    type: Optional[int]
+    status: Optional[int]
+    managed: bool
+    has_log: bool
+    caseno: Optional[int]
+    bugzillano: List[str]
+    started_time: Optional[int]
+    finished_time: Optional[int]
+    downloaded: Optional[str]
+    remote: List[str]
+    md5sum: Optional[str]
+
+
+def make_task_record(row: Mapping[str, Any]) -> TaskRecord:
+    """Converts raw column values (a database row or a dictionary) to TaskRecord."""
+    bugzillano = []
+    if row["bugzillano"]:
+        bugzillano = [bz for bz in set(n.strip() for n in row["bugzillano"].split("\n")) if bz]
+
+    remote = []
+    if row["remote"]:
+        remote = row["remote"].splitlines()
+
+    return TaskRecord(taskid=row["taskid"],
+                      type=row["type"],
+                      status=row["status"],
+                      managed=bool(row["managed"]),
+                      has_log=bool(row["has_log"]),
+                      caseno=row["caseno"],
+                      bugzillano=bugzillano,
+                      started_time=row["started_time"],
+                      finished_time=row["finished_time"],
+                      downloaded=row["downloaded"],
+                      remote=remote,
+                      md5sum=row["md5sum"])
+
+
+def init_taskindex_db() -> sqlite3.Connection:
+    # create the database group-writable and world-readable
+    old_umask = os.umask(0o113)
+    con = sqlite3.connect(os.path.join(CONFIG["SaveDir"], CONFIG["TaskIndexFile"]), timeout=30)
+    os.umask(old_umask)
+    con.row_factory = sqlite3.Row
+
+    columns = ", ".join("%s %s" % (name, sqltype) for name, sqltype in TASK_INDEX_COLUMNS.items())
+    query = con.cursor()
+    query.execute("CREATE TABLE IF NOT EXISTS tasks(taskid INTEGER PRIMARY KEY, %s)" % columns)
+    query.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status)")
+    query.execute("CREATE INDEX IF NOT EXISTS tasks_managed ON tasks(managed)")
+    con.commit()
+
+    return con
+
+
+def update_task_index(taskid: int, values: Dict[str, Any],
+                      con: Optional[sqlite3.Connection] = None) -> None:
+    """Creates the index entry of the task if needed and sets given columns."""
+    for column in values:
+        if column not in TASK_INDEX_COLUMNS:
+            raise ValueError("Unknown task index column '%s'" % column)
+
+    close = False
+    if con is None:
+        con = init_taskindex_db()
+        close = True
+
+    query = con.cursor()
+    query.execute("INSERT OR IGNORE INTO tasks (taskid) VALUES (?)", (taskid,))
+    if values:
+        assignments = ", ".join("%s = ?" % column for column in values)
+        query.execute("UPDATE tasks SET %s WHERE taskid = ?" % assignments,
+                      list(values.values()) + [taskid])
+
+    con.commit()
+    if close:
+        con.close()
+
+
+def delete_task_index(taskid: int, con: Optional[sqlite3.Connection] = None) -> None:
+    close = False
+    if con is None:
+        con = init_taskindex_db()
+        close = True
+
+    query = con.cursor()
+    query.execute("DELETE FROM tasks WHERE taskid = ?", (taskid,))
+
+    con.commit()
+    if close:
+        con.close()
+
+
+def clear_task_index(con: Optional[sqlite3.Connection] = None) -> None:
+    close = False
+    if con is None:
+        con = init_taskindex_db()
+        close = True
+
+    query = con.cursor()
+    query.execute("DELETE FROM tasks")
+
+    con.commit()
+    if close:
+        con.close()
+
+
+def query_task_index(con: Optional[sqlite3.Connection] = None, **filters: Any) -> List[TaskRecord]:
+    """Returns records of all indexed tasks matching the filters. Each filter
+    is a column name with either a single value or a list of allowed values."""
+    conditions = []
+    params: List[Any] = []
+    for column, value in filters.items():
+        if column not in TASK_INDEX_COLUMNS:
+            raise ValueError("Unknown task index column '%s'" % column)
+
+        if value is None:
+            conditions.append("%s IS NULL" % column)
+        elif isinstance(value, (list, tuple, set)):
+            conditions.append("%s IN (%s)" % (column, ", ".join("?" * len(value))))
+            params.extend(value)
+        else:
+            conditions.append("%s = ?" % column)
+            params.append(value)
+
+    sql = "SELECT * FROM tasks"
+    if conditions:
+        sql += " WHERE %s" % " AND ".join(conditions)
+    sql += " ORDER BY taskid"
+
+    close = False
+    if con is None:
+        con = init_taskindex_db()
+        close = True
+
+    query = con.cursor()
+    result = [make_task_record(row) for row in query.execute(sql, params)]
+
+    if close:
+        con.close()
+
+    return result
+
+
+def filter_task_records(records: Iterable[TaskRecord], **filters: Any) -> List[TaskRecord]:
+    """Same as query_task_index(), but evaluated on records already in memory."""
+    for field in filters:
+        if field not in TaskRecord._fields:
+            raise ValueError("Unknown task record field '%s'" % field)
+
+    result = []
+    for record in records:
+        for field, value in filters.items():
+            allowed = value if isinstance(value, (list, tuple, set)) else [value]
+            if getattr(record, field) not in allowed:
+                break
+        else:
+            result.append(record)
+
+    return result
@@ -0,0 +1,120 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .config import Config
+
+CONFIG = Config()
+
+TREE_HASH_VERSION = 1
+TREE_HASH_ALGORITHM = "sha256"
+
+# size of a single read while hashing a chunk
+READ_SIZE = 8 << 20
+
+
+def get_chunk_size() -> int:
+    return max(1, CONFIG["TreeHashChunkSize"]) << 20
+
+
+def get_hash_threads() -> int:
+    if CONFIG["TreeHashThreads"] > 0:
+        return CONFIG["TreeHashThreads"]
+
+    return os.cpu_count() or 1
+
+
+def _hash_chunk(fd: int, offset: int, length: int) -> str:
+    # hashlib releases the GIL on large buffers, so chunks are hashed in parallel
+    chunk_hash = hashlib.new(TREE_HASH_ALGORITHM)
+    end = offset + length
+    while offset < end:
+        data = os.pread(fd, min(READ_SIZE, end - offset), offset)
+        if not data:
+            raise OSError("Unexpected end of file at offset %d" % offset)
+        chunk_hash.update(data)
+        offset += len(data)
+
+    return chunk_hash.hexdigest()
+
+
+def hash_chunks(path: Union[str, Path], chunk_size: int, size: int,
+                chunks: Optional[Iterable[int]] = None) -> List[str]:
+    """Returns hashes of the given chunks (all by default) of the first size
+    bytes of path, computed by up to TreeHashThreads threads."""
+    if chunks is None:
+        chunks = range(-(-size // chunk_size))
+    chunks = list(chunks)
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(get_hash_threads(), len(chunks)))) as executor:
+            return list(executor.map(lambda chunk: _hash_chunk(fd, chunk * chunk_size,
+                                                               min(chunk_size, size - chunk * chunk_size)),
+                                     chunks))
+    finally:
+        os.close(fd)
+
+
+def get_root_hash(chunk_hashes: List[str]) -> str:
+    """Combines chunk hashes into a single hash of the whole file."""
+    root = hashlib.new(TREE_HASH_ALGORITHM)
+    for chunk_hash in chunk_hashes:
+        root.update(bytes.fromhex(chunk_hash))
+
+    return root.hexdigest()
+
+
+def is_tree_hash_current(tree: Optional[Dict[str, Any]], path: Union[str, Path]) -> bool:
+    """Whether tree describes the current contents of path. Only the size
+    and modification time are checked, see verify_tree_hash() for the data."""
+    if not tree or tree.get("version") != TREE_HASH_VERSION or tree.get("algorithm") != TREE_HASH_ALGORITHM:
+        return False
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+
+    return tree.get("size") == st.st_size and tree.get("mtime_ns") == st.st_mtime_ns
+
+
+def compute_tree_hash(path: Union[str, Path], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Returns the tree hash of path: hashes of TreeHashChunkSize chunks and
+    the root hash combining them. The previous tree hash is returned
+    as it is if the file has not changed since."""
+    if previous is not None and previous.get("chunk_size") == get_chunk_size() and \
+       is_tree_hash_current(previous, path):
+        return previous
+
+    st = os.stat(path)
+    chunk_size = get_chunk_size()
+    chunks = hash_chunks(path, chunk_size, st.st_size)
+    return {"version": TREE_HASH_VERSION,
+            "algorithm": TREE_HASH_ALGORITHM,
+            "chunk_size": chunk_size,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "chunks": chunks,
+            "root": get_root_hash(chunks)}
+
+
+def verify_tree_hash(path: Union[str, Path], tree: Dict[str, Any],
+                     chunks: Optional[Iterable[int]] = None) -> List[int]:
+    """Re-reads the given chunks (all by default) of path and returns
+    indices of those that do not match tree. Checking a few chunks
+    at a time allows spreading the check of a large file over time."""
+    if chunks is None:
+        chunks = range(len(tree["chunks"]))
+    chunks = [chunk for chunk in chunks if 0 <= chunk < len(tree["chunks"])]
+
+    if os.stat(path).st_size != tree["size"]:
+        return chunks
+
+    hashes = hash_chunks(path, tree["chunk_size"], tree["size"], chunks)
+    return [chunk for chunk, chunk_hash in zip(chunks, hashes) if chunk_hash != tree["chunks"][chunk]]
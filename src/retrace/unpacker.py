@@ -0,0 +1,261 @@
+import bz2
+import functools
+import gzip
+import lzma
+import queue
+import shutil
+import tarfile
+import threading
+from pathlib import Path, PurePosixPath
+from typing import IO, Any, Callable, Dict, List, Optional, cast
+
+from .download import DownloadError
+from .sparse import copy_sparse
+
+# size of reads from the decompressed stream
+BLOCK_SIZE = 1 << 20
+# chunks waiting for the unpacking thread, bounds the memory used
+QUEUE_CHUNKS = 4
+# enough to see the magic of all formats below, tar has it at offset 257
+SNIFF_SIZE = 512
+# seconds between checks whether the unpacking thread has failed
+PUT_TIMEOUT = 0.5
+
+CODEC_GZIP = "gzip"
+CODEC_BZIP2 = "bzip2"
+CODEC_XZ = "xz"
+CODEC_TAR = "tar"
+
+DECOMPRESSORS: Dict[str, Callable[[Any], Any]] = {
+    CODEC_GZIP: lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode="rb"),
+    CODEC_BZIP2: lambda fileobj: bz2.BZ2File(fileobj, mode="rb"),
+    CODEC_XZ: lambda fileobj: lzma.LZMAFile(fileobj, mode="rb"),
+}
+
+# file name suffixes dropped by the decompressor, as gunzip etc. do
+SUFFIXES = {
+    CODEC_GZIP: {".gz": "", ".z": "", ".tgz": ".tar"},
+    CODEC_BZIP2: {".bz2": "", ".tbz2": ".tar", ".tbz": ".tar"},
+    CODEC_XZ: {".xz": "", ".txz": ".tar"},
+}
+
+
+def sniff_codec(block: bytes) -> Optional[str]:
+    """Returns the compression or archive format of data starting with block
+    or None if it is not one that can be unpacked as a stream."""
+    if block.startswith(b"\x1f\x8b\x08"):
+        return CODEC_GZIP
+    if block.startswith(b"BZh") and block[3:4].isdigit():
+        return CODEC_BZIP2
+    if block.startswith(b"\xfd7zXZ\x00"):
+        return CODEC_XZ
+    if block[257:262] == b"ustar":
+        return CODEC_TAR
+
+    return None
+
+
+def strip_suffix(name: str, codec: str) -> str:
+    for suffix, replacement in SUFFIXES.get(codec, {}).items():
+        if name.lower().endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)] + replacement
+
+    return name + ".unpacked"
+
+
+class _Reader:
+    """Buffered reader of data returned by fill() with peek() of any size.
+    fill() returns an empty string at the end of the data."""
+
+    def __init__(self, fill: Callable[[], bytes]) -> None:
+        self._fill = fill
+        self._buffer = b""
+        self._eof = False
+
+    def peek(self, size: int) -> bytes:
+        while not self._eof and len(self._buffer) < size:
+            data = self._fill()
+            if not data:
+                self._eof = True
+            self._buffer += data
+
+        return self._buffer[:size]
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._buffer and not self._eof:
+            self._buffer = self._fill()
+            if not self._buffer:
+                self._eof = True
+
+        if size < 0:
+            while not self._eof:
+                self.peek(len(self._buffer) + BLOCK_SIZE)
+            size = len(self._buffer)
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+
+class StreamUnpacker:
+    """Unpacks data while it is being downloaded, so that the compressed
+    file never hits the disk and unpacking overlaps with the download.
+
+    write() takes the data in order. A thread sniffs the magic bytes of
+    the first block, decompresses gzip, bzip2 and xz (possibly several
+    layers of them) and extracts tar archives into targetdir. Data in other
+    formats is stored as it is under the original name and left for
+    unpack_vmcore() or unpack_coredump(). With sparse, blocks of zeros
+    are left as holes in the files written."""
+
+    def __init__(self, targetdir: Path, name: str, sparse: bool = False) -> None:
+        self.targetdir = targetdir
+        self.name = name
+        self.sparse = sparse
+        # bytes passed to write() so far
+        self.position = 0
+        # formats found, outermost first
+        self.codecs: List[str] = []
+        self.files: List[Path] = []
+        # tar members not extracted for their unsafe path
+        self.skipped: List[str] = []
+
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(QUEUE_CHUNKS)
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start()
+
+    def _start(self) -> None:
+        self._queue = queue.Queue(QUEUE_CHUNKS)
+        self._error = None
+        self.position = 0
+        self.codecs = []
+        self.files = []
+        self.skipped = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _put(self, chunk: Optional[bytes]) -> None:
+        assert self._thread is not None
+        while True:
+            if self._error is not None or not self._thread.is_alive():
+                self._raise()
+            try:
+                self._queue.put(chunk, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def _raise(self) -> None:
+        error = self._error or Exception("unpacking stopped early")
+        raise DownloadError("Unable to unpack %s: %s" % (self.name, error)) from error
+
+    def write(self, data: bytes) -> None:
+        self._put(bytes(data))
+        self.position += len(data)
+
+    def close(self) -> List[Path]:
+        """Waits until everything is unpacked and returns the created files."""
+        assert self._thread is not None
+        self._put(None)
+        self._thread.join()
+        if self._error is not None:
+            self._raise()
+
+        return self.files
+
+    def abort(self) -> None:
+        """Stops unpacking and removes the files created so far."""
+        assert self._thread is not None
+        # an early end of the data stops the thread
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self._queue.put(None, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            pass
+        self._thread.join()
+
+        for path in self.files:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def reset(self) -> None:
+        """Starts over, used when the data is sent again from the beginning."""
+        self.abort()
+        self._start()
+
+    def get_main_file(self) -> Optional[Path]:
+        """Returns the largest file created."""
+        sizes = [(path.stat().st_size, path) for path in self.files if path.is_file()]
+        if not sizes:
+            return None
+
+        return max(sizes)[1]
+
+    def _next_chunk(self) -> bytes:
+        chunk = self._queue.get()
+        if chunk is None:
+            return b""
+
+        return chunk
+
+    def _run(self) -> None:
+        try:
+            raw = _Reader(self._next_chunk)
+            stream = raw
+            name = self.name
+            codec = sniff_codec(stream.peek(SNIFF_SIZE))
+            while codec in DECOMPRESSORS:
+                self.codecs.append(codec)
+                decompressed = DECOMPRESSORS[codec](stream)
+                stream = _Reader(functools.partial(decompressed.read, BLOCK_SIZE))
+                name = strip_suffix(name, codec)
+                codec = sniff_codec(stream.peek(SNIFF_SIZE))
+
+            if codec == CODEC_TAR:
+                self.codecs.append(codec)
+                self._extract_tar(stream)
+            else:
+                self._write_file(stream, self.targetdir / name)
+
+            # e.g. the padding after a tar archive
+            while raw.read(BLOCK_SIZE):
+                pass
+        except BaseException as ex:
+            self._error = ex
+
+    def _write_file(self, stream: Any, path: Path) -> None:
+        self.files.append(path)
+        with open(path, "wb") as target_file:
+            if self.sparse:
+                copy_sparse(stream, target_file, BLOCK_SIZE)
+            else:
+                shutil.copyfileobj(stream, target_file, BLOCK_SIZE)
+
+    def _extract_tar(self, stream: _Reader) -> None:
+        # a stream is only read forward, which is all _Reader supports
+        with tarfile.open(fileobj=cast(IO[bytes], stream), mode="r|") as tar:
+            for member in tar:
+                relpath = PurePosixPath(member.name)
+                if relpath.is_absolute() or ".." in relpath.parts:
+                    self.skipped.append(member.name)
+                    continue
+
+                path = self.targetdir.joinpath(*relpath.parts)
+                if member.isdir():
+                    path.mkdir(parents=True, exist_ok=True)
+                    continue
+
+                # links and special files are of no use for retracing
+                if not member.isfile():
+                    self.skipped.append(member.name)
+                    continue
+
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._write_file(tar.extractfile(member), path)
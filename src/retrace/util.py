@@ -2,17 +2,23 @@ import copy
 import os
 import re
 import errno
+import functools
 import ftplib
 import gettext
+import io
+import shutil
 import smtplib
+import threading
+import time
 
 from pathlib import Path
-from subprocess import run, PIPE
-from typing import cast, Any, Callable, Dict, List, Optional, SupportsFloat, Tuple, Union
+from subprocess import run, DEVNULL, PIPE, Popen
+from typing import cast, Any, Callable, Dict, List, NamedTuple, Optional, SupportsFloat, Tuple, Union
 from dnf.subject import Subject
 from hawkey import FORM_NEVRA
 
 from .config import Config, DF_BIN, GZIP_BIN, TAR_BIN, XZ_BIN
+from .sparse import get_allocated_size, is_sparse
 
 GETTEXT_DOMAIN = "retrace-server"
 
@@ -34,7 +40,7 @@ URL_PARSER = re.compile(r"^/([0-9]+)/?")
 
 ARCHIVE_UNKNOWN, ARCHIVE_GZ, ARCHIVE_ZIP, \
   ARCHIVE_BZ2, ARCHIVE_XZ, ARCHIVE_TAR, \
-  ARCHIVE_7Z, ARCHIVE_LZOP = range(8)
+  ARCHIVE_7Z, ARCHIVE_LZOP, ARCHIVE_ZSTD = range(9)
 
 HANDLE_ARCHIVE = {
     "application/x-xz-compressed-tar": {
@@ -56,9 +62,119 @@ HANDLE_ARCHIVE = {
                  re.compile(r"^[ \t]*[^ ^\t]+[ \t]+[^ ^\t]+[ \t]+[^ ^\t]+[ \t]+[^ ^\t]+[ \t]+([0-9]+).*$")),
         "type": ARCHIVE_TAR,
     },
+
+    "application/zstd": {
+        "unpack": [TAR_BIN, "--zstd", "-xf"],
+        # streamed archives do not record the size, see unpacked_size()
+        "size": (["zstd", "--list", "-v"], re.compile(r"^Decompressed Size:.*\(([0-9]+) B\)")),
+        "type": ARCHIVE_ZSTD,
+    },
+}
+
+
+class Decompressor(NamedTuple):
+    program: str
+    # arguments setting the number of threads, {threads} is replaced by the count
+    thread_args: Tuple[str, ...] = ()
+    # whether the threads are used for decompression or just for compression
+    threaded_decompression: bool = True
+
+
+# Decompressors of each archive type in the order of preference, parallel
+# ones are used if installed. The last one is the fallback.
+DECOMPRESSORS: Dict[int, List[Decompressor]] = {
+    ARCHIVE_GZ: [Decompressor("pigz", ("-p", "{threads}")),
+                 Decompressor(GZIP_BIN)],
+    ARCHIVE_BZ2: [Decompressor("lbzip2", ("-n", "{threads}")),
+                  Decompressor("pbzip2", ("-p{threads}",)),
+                  Decompressor("bzip2")],
+    # multi-threaded decompression needs xz 5.4, older versions ignore -T
+    ARCHIVE_XZ: [Decompressor(XZ_BIN, ("-T", "{threads}"))],
+    ARCHIVE_ZSTD: [Decompressor("zstd", ("-T{threads}",), threaded_decompression=False)],
 }
 
 
+@functools.lru_cache(maxsize=None)
+def is_program_installed(program: str) -> bool:
+    return shutil.which(program) is not None
+
+
+def get_decompressor(archive_type: int) -> Decompressor:
+    """Returns the first installed decompressor of archive_type."""
+    decompressors = DECOMPRESSORS[archive_type]
+    for decompressor in decompressors[:-1]:
+        if is_program_installed(decompressor.program):
+            return decompressor
+
+    return decompressors[-1]
+
+
+def get_decompress_command(archive_type: int, threads: int = 1, for_tar: bool = False) -> List[str]:
+    """Returns the command decompressing a file of archive_type in place
+    using up to threads threads. For tar's --use-compress-program, -d is
+    left out as tar adds it."""
+    decompressor = get_decompressor(archive_type)
+    cmd = [decompressor.program]
+    if not for_tar:
+        cmd.append("-d")
+    if decompressor.threaded_decompression:
+        cmd.extend(arg.format(threads=max(1, threads)) for arg in decompressor.thread_args)
+
+    return cmd
+
+
+def get_compress_command(archive_type: int, threads: int = 1) -> List[str]:
+    """Returns the command compressing by the codec of archive_type using up
+    to threads threads, also suitable for tar's --use-compress-program."""
+    decompressor = get_decompressor(archive_type)
+    return [decompressor.program] + [arg.format(threads=max(1, threads)) for arg in decompressor.thread_args]
+
+
+# codecs that can be selected for archived tasks and stored task files
+COMPRESSION_CODECS = {
+    "gzip": ARCHIVE_GZ,
+    "bzip2": ARCHIVE_BZ2,
+    "xz": ARCHIVE_XZ,
+    "zstd": ARCHIVE_ZSTD,
+}
+
+
+def _run_to_file(cmd: List[str], target: Path) -> None:
+    """Stores the output of cmd into target, which is replaced only on success."""
+    tmp = target.with_name(target.name + ".tmp")
+    with open(tmp, "wb") as f:
+        child = run(cmd, stdout=f, stderr=PIPE, encoding="utf-8", check=False)
+
+    if child.returncode:
+        tmp.unlink()
+        raise Exception("%s exited with %d: %s" % (cmd[0], child.returncode, child.stderr))
+
+    tmp.rename(target)
+
+
+def compress_file(source: Path, target: Path, archive_type: int, threads: int = 1) -> None:
+    """Writes source compressed by the codec of archive_type into target."""
+    _run_to_file(get_compress_command(archive_type, threads) + ["-c", str(source)], target)
+    shutil.copymode(source, target)
+
+
+def decompress_file(source: Path, target: Path, archive_type: int) -> None:
+    _run_to_file(get_decompress_command(archive_type) + ["-c", str(source)], target)
+    shutil.copymode(source, target)
+
+
+def read_compressed_file(path: Path, archive_type: int, maxlen: int) -> str:
+    """Returns up to maxlen characters of the decompressed contents of path."""
+    with Popen(get_decompress_command(archive_type) + ["-c", str(path)], stdout=PIPE, stderr=DEVNULL) as child:
+        assert child.stdout is not None
+        result = io.TextIOWrapper(child.stdout, encoding="utf-8", errors="replace").read(maxlen)
+        if child.poll() is None:
+            # the rest is not needed
+            child.kill()
+
+    return result
+
+
 def lock(lockfile: Path) -> bool:
     try:
         fd = os.open(lockfile, os.O_CREAT | os.O_EXCL, 0o600)
@@ -137,6 +253,71 @@ def human_readable_size(bytesize: SupportsFloat) -> str:
     return "%.2f %s" % (size, UNITS[unit])
 
 
+def human_readable_file_size(st: os.stat_result) -> str:
+    """Returns the apparent size of a file followed by the space it takes on disk if the file is sparse."""
+    size = human_readable_size(st.st_size)
+    if is_sparse(st):
+        size += " (%s allocated)" % human_readable_size(get_allocated_size(st))
+
+    return size
+
+
+class ProgressReporter:
+    """Tracks progress of a transfer of known size and passes it to sink
+    as a human readable string. The sink is called at most once per
+    min_interval seconds and only after at least min_bytes have been
+    transferred since the last call, so that it may be expensive.
+    It may be shared by several threads transferring at once."""
+
+    def __init__(self, total: int, sink: Callable[[str], None],
+                 min_interval: float = 1.0, min_bytes: int = 0) -> None:
+        self.total = total
+        self.current = 0
+        self.sink = sink
+        self.min_interval = min_interval
+        self.min_bytes = min_bytes
+        self._total_str = human_readable_size(total)
+        self._reported_time: Optional[float] = None
+        self._reported_bytes = 0
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        percent = 100
+        if self.total > 0:
+            percent = (100 * self.current) // self.total
+
+        return "%d%% (%s / %s)" % (percent, human_readable_size(self.current), self._total_str)
+
+    def expect(self, nbytes: int) -> None:
+        """Adds nbytes to the total, used when the size of a part becomes known."""
+        with self._lock:
+            self.total += nbytes
+            self._total_str = human_readable_size(self.total)
+
+    def update(self, nbytes: int) -> None:
+        """Adds nbytes to the transferred amount and reports if due."""
+        with self._lock:
+            self.current += nbytes
+            now = time.monotonic()
+            if self._reported_time is not None and \
+               (now - self._reported_time < self.min_interval or
+                self.current - self._reported_bytes < self.min_bytes):
+                return
+
+            self._report(now)
+
+    def finish(self) -> None:
+        """Reports the final state unless it has been reported already."""
+        with self._lock:
+            if self._reported_time is None or self._reported_bytes != self.current:
+                self._report(time.monotonic())
+
+    def _report(self, now: float) -> None:
+        self._reported_time = now
+        self._reported_bytes = self.current
+        self.sink(str(self))
+
+
 def parse_http_gettext(lang: str, charset: str) -> Callable[[str], str]:
     result = lambda x: x
     lang_match = INPUT_LANG_PARSER.match(lang)
@@ -220,8 +401,13 @@ def splitFilename(filename: str) -> Union[Tuple[None, None, None, None, None], T
     return nevra.name, nevra.version, nevra.release, nevra.epoch, nevra.arch
 
 
-def unpack(archive: str, mime: str, targetdir: Optional[str] = None) -> int:
-    cmd = copy.copy(cast(List[str], HANDLE_ARCHIVE[mime]["unpack"]))
+def unpack(archive: str, mime: str, targetdir: Optional[str] = None, threads: int = 1) -> int:
+    archive_type = HANDLE_ARCHIVE[mime]["type"]
+    if archive_type in DECOMPRESSORS:
+        program = " ".join(get_decompress_command(cast(int, archive_type), threads, for_tar=True))
+        cmd = [TAR_BIN, "-x", "--use-compress-program=%s" % program, "-f"]
+    else:
+        cmd = copy.copy(cast(List[str], HANDLE_ARCHIVE[mime]["unpack"]))
     cmd.append(archive)
     if targetdir is not None:
         cmd.append("--directory")
@@ -239,4 +425,28 @@ def unpacked_size(archive: str, mime: str) -> Optional[int]:
         if match:
             return int(match.group(1))
 
+    # the size is not recorded, count the decompressed data up to the limit
+    if mime == "application/zstd":
+        CONFIG = Config()
+        return _count_decompressed(archive, ARCHIVE_ZSTD, (CONFIG["MaxUnpackedSize"] << 20) + 1)
+
     return None
+
+
+def _count_decompressed(archive: str, archive_type: int, limit: int) -> Optional[int]:
+    """Returns the decompressed size of archive, stops counting at limit."""
+    size = 0
+    with Popen(get_decompress_command(archive_type) + ["-c", archive], stdout=PIPE, stderr=DEVNULL) as child:
+        assert child.stdout is not None
+        while size < limit:
+            data = child.stdout.read(1 << 20)
+            if not data:
+                break
+            size += len(data)
+        if size >= limit:
+            child.kill()
+
+    if child.returncode and size < limit:
+        return None
+
+    return size
@@ -0,0 +1,132 @@
+import os
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from .config import Config
+
+CONFIG = Config()
+
+
+class WorkerEntry(NamedTuple):
+    """A worker process as registered in the worker registry."""
+    pid: int
+    taskid: int
+    # start time of the process in clock ticks after boot, see proc(5)
+    proc_start: int
+    started: int
+    phase: Optional[int]
+
+
+def get_worker_registry_dir() -> Path:
+    return Path(CONFIG["SaveDir"], CONFIG["WorkerRegistryDir"])
+
+
+def get_proc_start_time(pid: int) -> Optional[int]:
+    """Returns the start time of the process from /proc/<pid>/stat,
+    None if there is no such process."""
+    try:
+        # bytes, the command name may be in any encoding
+        with open("/proc/%d/stat" % pid, "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # the command name may contain spaces and parentheses,
+    # starttime is the 22nd field, the 20th after the name
+    try:
+        return int(stat[stat.rindex(b")") + 2:].split()[19])
+    except (ValueError, IndexError):
+        return None
+
+
+def _read_entry(path: Path) -> Optional[WorkerEntry]:
+    try:
+        fields = path.read_text().split()
+        return WorkerEntry(pid=int(fields[0]),
+                           taskid=int(path.name),
+                           proc_start=int(fields[1]),
+                           started=int(fields[2]),
+                           phase=int(fields[3]) if len(fields) > 3 and fields[3] != "-" else None)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _write_entry(entry: WorkerEntry) -> None:
+    registry = get_worker_registry_dir()
+    path = registry / str(entry.taskid)
+    tmppath = registry / (".%d.tmp" % entry.taskid)
+    phase = "-" if entry.phase is None else str(entry.phase)
+    tmppath.write_text("%d %d %d %s\n" % (entry.pid, entry.proc_start, entry.started, phase))
+    tmppath.rename(path)
+
+
+def register_worker(taskid: int, phase: Optional[int] = None) -> None:
+    """Registers the current process as the worker of the task."""
+    pid = os.getpid()
+    proc_start = get_proc_start_time(pid)
+    if proc_start is None:
+        raise OSError("Unable to read start time of process %d" % pid)
+
+    # group-writable, so that the web server can remove stale entries
+    old_umask = os.umask(0o002)
+    try:
+        get_worker_registry_dir().mkdir(parents=True, exist_ok=True)
+        _write_entry(WorkerEntry(pid, taskid, proc_start, int(time.time()), phase))
+    finally:
+        os.umask(old_umask)
+
+
+def unregister_worker(taskid: int) -> None:
+    """Removes the registration of the task if it belongs to the current process."""
+    path = get_worker_registry_dir() / str(taskid)
+    entry = _read_entry(path)
+    if entry is not None and entry.pid == os.getpid():
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def set_worker_phase(taskid: int, phase: int) -> None:
+    """Updates the phase if the current process is the registered worker
+    of the task, does nothing otherwise."""
+    entry = _read_entry(get_worker_registry_dir() / str(taskid))
+    if entry is None or entry.pid != os.getpid() or entry.phase == phase:
+        return
+
+    _write_entry(entry._replace(phase=phase))
+
+
+def get_registered_workers() -> List[WorkerEntry]:
+    """Returns live registered workers. A worker is alive if its PID exists
+    and belongs to the same process as when it was registered. Entries
+    of dead workers are removed."""
+    registry = get_worker_registry_dir()
+    try:
+        names = os.listdir(registry)
+    except FileNotFoundError:
+        return []
+
+    result = []
+    for name in names:
+        if not name.isdigit():
+            continue
+
+        path = registry / name
+        entry = _read_entry(path)
+        if entry is None:
+            continue
+
+        if get_proc_start_time(entry.pid) != entry.proc_start:
+            # the worker may have been restarted meanwhile
+            try:
+                if _read_entry(path) == entry:
+                    path.unlink()
+            except OSError:
+                pass
+            continue
+
+        result.append(entry)
+
+    return result
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Tests of retrace.download.HTTPDownloader against a local http.server."""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional
+from unittest import mock
+
+from retrace.config import Config
+from retrace.download import PART_SUFFIX, SEGMENTS_SUFFIX, DownloadError, HTTPDownloader, StreamHasher
+from retrace.unpacker import StreamUnpacker
+
+RANGE_PARSER = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+DATA = os.urandom((3 << 20) + 12345)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "Server"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        data = self.server.data
+        requested = self.headers.get("Range")
+        with self.server.lock:
+            self.server.requests.append((self.path, requested))
+
+        start, end = 0, len(data)
+        status = 200
+        match = RANGE_PARSER.match(requested or "")
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)) + 1)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % len(data))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(data)))
+        self.end_headers()
+
+        body = data[start:end]
+        with self.server.lock:
+            cut = self.server.cut_after
+            self.server.cut_after = None
+        if cut is not None and cut < len(body):
+            # the connection breaks in the middle of the response
+            self.wfile.write(body[:cut])
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.data = DATA
+        self.ranges = True
+        self.cut_after: Optional[int] = None
+        self.requests: List[tuple] = []
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address) -> None:
+        # the downloader drops connections whose response it does not need
+        pass
+
+
+class TestHTTPDownloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.config = Config()
+        cls.config.load()
+        cls.saved_config = dict(cls.config.GLOBAL)
+        cls.config.GLOBAL.update(HTTPSegmentMinSize=1, HTTPParallelSegments=4, HTTPRetries=2, HTTPTimeout=10)
+
+        cls.server = Server()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = "http://127.0.0.1:%d/vmcore.tar.gz" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.config.GLOBAL.update(cls.saved_config)
+
+    def setUp(self) -> None:
+        self.server.ranges = True
+        self.server.cut_after = None
+        self.server.requests = []
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.target = Path(self.tmpdir.name, "vmcore.tar.gz")
+        self.part = self.target.with_name(self.target.name + PART_SUFFIX)
+        self.segments = self.target.with_name(self.target.name + SEGMENTS_SUFFIX)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def download(self) -> None:
+        hasher = StreamHasher()
+        with HTTPDownloader(hasher=hasher) as downloader:
+            downloader.download(self.url, self.target)
+
+        self.assertEqual(self.target.read_bytes(), DATA)
+        self.assertFalse(self.part.exists())
+        self.assertFalse(self.segments.exists())
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(DATA).hexdigest())
+
+    def test_segmented(self) -> None:
+        self.download()
+
+        segment_requests = [requested for _, requested in self.server.requests
+                            if requested is not None and RANGE_PARSER.match(requested).group(2)]
+        self.assertEqual(len(segment_requests), 3)
+
+    def test_without_ranges(self) -> None:
+        self.server.ranges = False
+        self.download()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_resume_part(self) -> None:
+        self.config.GLOBAL["HTTPParallelSegments"] = 1
+        try:
+            self.part.write_bytes(DATA[:1000])
+            self.download()
+        finally:
+            self.config.GLOBAL["HTTPParallelSegments"] = 4
+
+        self.assertEqual(self.server.requests[0][1], "bytes=1000-")
+
+    def test_resume_segments(self) -> None:
+        half = len(DATA) // 2
+        self.part.write_bytes(DATA[:half] + bytes(len(DATA) - half))
+        self.segments.write_text(json.dumps({"url": self.url,
+                                             "size": len(DATA),
+                                             "segments": [[0, half, half], [half, len(DATA), 0]]}))
+        self.download()
+
+        self.assertEqual([requested for _, requested in self.server.requests],
+                         ["bytes=%d-%d" % (half, len(DATA) - 1)])
+
+    def test_already_complete(self) -> None:
+        self.part.write_bytes(DATA)
+        self.download()
+
+        self.assertEqual([requested for _, requested in self.server.requests],
+                         ["bytes=%d-" % len(DATA)])
+
+    def test_retry(self) -> None:
+        self.config.GLOBAL["HTTPParallelSegments"] = 1
+        self.server.cut_after = 5000
+        try:
+            with mock.patch("time.sleep"):
+                self.download()
+        finally:
+            self.config.GLOBAL["HTTPParallelSegments"] = 4
+
+        self.assertEqual(self.server.requests[-1][1], "bytes=5000-")
+
+    def test_sink_aborted(self) -> None:
+        self.config.GLOBAL["HTTPRetries"] = 0
+        self.server.cut_after = 5000
+        unpacker = StreamUnpacker(Path(self.tmpdir.name), self.target.name)
+        try:
+            with HTTPDownloader(sink=unpacker) as downloader:
+                with self.assertRaises(DownloadError):
+                    downloader.download(self.url, self.target)
+        finally:
+            self.config.GLOBAL["HTTPRetries"] = 2
+
+        # the unpacking thread is stopped and the partial file removed
+        self.assertFalse(unpacker._thread.is_alive())
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_proxy(self) -> None:
+        proxy = "http://127.0.0.1:%d" % self.server.server_address[1]
+        url = "http://retrace.invalid/vmcore.tar.gz"
+        with mock.patch.dict(os.environ, {"http_proxy": proxy, "no_proxy": ""}):
+            with HTTPDownloader() as downloader:
+                downloader.download(url, self.target)
+
+        self.assertEqual(self.target.read_bytes(), DATA)
+        self.assertTrue(all(urllib.parse.urlsplit(path).netloc == "retrace.invalid"
+                            for path, _ in self.server.requests))
+
+
+if __name__ == "__main__":
+    unittest.main()
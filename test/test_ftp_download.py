@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Tests of retrace.download.FTPDownloader against a local pyftpdlib server."""
+
+import ftplib
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from typing import List
+from unittest import mock
+
+from retrace.config import Config
+from retrace.download import PART_SUFFIX, SEGMENTS_SUFFIX, FTPDownloader, StreamHasher
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.log import config_logging
+    from pyftpdlib.servers import ThreadedFTPServer
+    HAVE_PYFTPDLIB = True
+except ImportError:
+    HAVE_PYFTPDLIB = False
+    FTPHandler = object
+
+FILENAME = "vmcore.tar.gz"
+DATA = os.urandom((3 << 20) + 12345)
+
+
+class Handler(FTPHandler):
+    # offsets requested by REST, the number of RETR commands received and still to be refused
+    rests: List[int] = []
+    retrs = 0
+    failures = 0
+    lock = threading.Lock()
+
+    def ftp_REST(self, line: str) -> None:
+        with self.lock:
+            self.rests.append(int(line))
+        super().ftp_REST(line)
+
+    def ftp_RETR(self, file: str) -> None:
+        with self.lock:
+            Handler.retrs += 1
+            fail = Handler.failures > 0
+            if fail:
+                Handler.failures -= 1
+        if fail:
+            self.respond("450 Transfer refused.")
+            return
+        super().ftp_RETR(file)
+
+
+@unittest.skipUnless(HAVE_PYFTPDLIB, "pyftpdlib is not installed")
+class TestFTPDownloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.ftpdir = tempfile.TemporaryDirectory()
+        Path(cls.ftpdir.name, FILENAME).write_bytes(DATA)
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user("retrace", "retrace", cls.ftpdir.name, perm="elr")
+        Handler.authorizer = authorizer
+        config_logging(level=logging.WARNING)
+        cls.server = ThreadedFTPServer(("127.0.0.1", 0), Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, kwargs={"timeout": 0.1}, daemon=True)
+        cls.thread.start()
+
+        cls.config = Config()
+        cls.config.load()
+        cls.saved_config = dict(cls.config.GLOBAL)
+        cls.config.GLOBAL.update(FTPSSL=False, FTPHost="127.0.0.1", FTPUser="retrace", FTPPass="retrace",
+                                 FTPDir="/", FTPSegmentMinSize=1, FTPParallelSegments=4, FTPRetries=2)
+        # ftp_init() connects to the default port
+        cls.port = mock.patch.object(ftplib.FTP, "port", cls.server.socket.getsockname()[1])
+        cls.port.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.port.stop()
+        cls.config.GLOBAL.update(cls.saved_config)
+        cls.server.close_all()
+        cls.thread.join()
+        cls.ftpdir.cleanup()
+
+    def setUp(self) -> None:
+        Handler.rests = []
+        Handler.retrs = 0
+        Handler.failures = 0
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.target = Path(self.tmpdir.name, FILENAME)
+        self.part = self.target.with_name(self.target.name + PART_SUFFIX)
+        self.segments = self.target.with_name(self.target.name + SEGMENTS_SUFFIX)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def download(self) -> None:
+        hasher = StreamHasher()
+        with mock.patch("time.sleep"), FTPDownloader(hasher=hasher) as downloader:
+            downloader.download(FILENAME, self.target)
+
+        self.assertEqual(self.target.read_bytes(), DATA)
+        self.assertFalse(self.part.exists())
+        self.assertFalse(self.segments.exists())
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(DATA).hexdigest())
+
+    def segment_starts(self) -> List[int]:
+        # REST 0 probes whether the server supports resuming
+        return sorted(rest for rest in Handler.rests if rest > 0)
+
+    def test_segmented(self) -> None:
+        self.download()
+
+        size = -(-len(DATA) // 3)
+        self.assertEqual(self.segment_starts(), [size, 2 * size])
+        self.assertEqual(Handler.retrs, 3)
+
+    def test_retry_segment(self) -> None:
+        Handler.failures = 1
+        self.download()
+
+        self.assertEqual(Handler.failures, 0)
+        # only the refused segment is requested again
+        self.assertEqual(Handler.retrs, 4)
+
+    def test_resume_part(self) -> None:
+        self.config.GLOBAL["FTPParallelSegments"] = 1
+        try:
+            self.part.write_bytes(DATA[:1000])
+            self.download()
+        finally:
+            self.config.GLOBAL["FTPParallelSegments"] = 4
+
+        self.assertEqual(self.segment_starts(), [1000])
+        self.assertEqual(Handler.retrs, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Tests of writing sparse files (retrace.sparse) and of unpacking downloads as they arrive (retrace.unpacker)."""
+
+import gzip
+import io
+import os
+import random
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+
+from retrace.sparse import (SPARSE_BLOCK_SIZE,
+                            SparseWriter,
+                            copy_sparse,
+                            get_allocated_size,
+                            sparsify_file)
+from retrace.unpacker import CODEC_GZIP, CODEC_TAR, StreamUnpacker
+
+BLOCK = SPARSE_BLOCK_SIZE
+
+
+def make_data(layout: str) -> bytes:
+    """Returns data of blocks described by layout, "d" for a block of random data,
+    "z" for a block of zeros."""
+    return b"".join(os.urandom(BLOCK) if kind == "d" else bytes(BLOCK) for kind in layout)
+
+
+def split(data: bytes, sizes: List[int]) -> List[bytes]:
+    """Cuts data into chunks of the given sizes, repeated until the data runs out."""
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        size = sizes[len(chunks) % len(sizes)]
+        chunks.append(data[offset:offset + size])
+        offset += size
+
+    return chunks
+
+
+class TestSparse(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name, "vmcore")
+
+        # not every file system used for temporary files has holes
+        probe = Path(self.tmpdir.name, "probe")
+        with open(probe, "wb") as f:
+            f.truncate(1 << 20)
+        self.holes = get_allocated_size(probe.stat()) == 0
+        probe.unlink()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def write(self, chunks: List[bytes]) -> None:
+        with open(self.path, "wb") as f:
+            writer = SparseWriter(f)
+            for chunk in chunks:
+                self.assertEqual(writer.write(chunk), len(chunk))
+            writer.finish()
+
+    def assertAllocated(self, blocks: int) -> None:
+        if self.holes:
+            self.assertEqual(get_allocated_size(self.path.stat()), blocks * BLOCK)
+
+    def test_write_aligned(self) -> None:
+        data = make_data("dzzdzzzd")
+        self.write([data])
+
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertAllocated(3)
+
+    def test_write_across_chunks(self) -> None:
+        # runs of zeros start and end in the middle of write() calls
+        data = make_data("dzzzdzzzzd")
+        for sizes in [[1], [BLOCK - 1], [BLOCK + 1], [100, 7000, 3 * BLOCK + 5]]:
+            with self.subTest(sizes=sizes[:4]):
+                self.write(split(data, sizes))
+
+                self.assertEqual(self.path.read_bytes(), data)
+                self.assertAllocated(3)
+
+    def test_unaligned_zeros(self) -> None:
+        # zeros not covering a whole aligned block are written
+        data = os.urandom(100) + bytes(BLOCK) + os.urandom(BLOCK - 100)
+        self.write([data])
+
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertAllocated(2)
+
+    def test_trailing_zeros(self) -> None:
+        data = make_data("dzzz")
+        self.write(split(data, [BLOCK // 2]))
+
+        self.assertEqual(self.path.stat().st_size, len(data))
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertAllocated(1)
+
+    def test_only_zeros(self) -> None:
+        self.write([bytes(3 * BLOCK)])
+
+        self.assertEqual(self.path.read_bytes(), bytes(3 * BLOCK))
+        self.assertAllocated(0)
+
+    def test_random(self) -> None:
+        rand = random.Random(0)
+        for _ in range(20):
+            data = make_data("".join(rand.choice("dz") for _ in range(rand.randint(1, 30))))
+            data += bytes(rand.randint(0, BLOCK))
+            self.write(split(data, [rand.randint(1, 3 * BLOCK) for _ in range(5)]))
+
+            self.assertEqual(self.path.read_bytes(), data)
+
+    def test_copy_sparse(self) -> None:
+        data = make_data("zdzzd") + bytes(10)
+        with open(self.path, "wb") as target:
+            copy_sparse(io.BytesIO(data), target, 3000)
+
+        self.assertEqual(self.path.read_bytes(), data)
+
+    def test_sparsify_file(self) -> None:
+        data = make_data("dzzdzzzz") + os.urandom(10)
+        self.path.write_bytes(data)
+
+        released = sparsify_file(self.path)
+
+        self.assertEqual(self.path.read_bytes(), data)
+        if self.holes:
+            self.assertEqual(released, 6 * BLOCK)
+            self.assertAllocated(3)
+            # the holes are skipped the next time
+            self.assertEqual(sparsify_file(self.path), 0)
+
+
+class TestStreamUnpacker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.targetdir = Path(self.tmpdir.name, "crash")
+        self.targetdir.mkdir()
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def unpack(self, data: bytes, name: str, sparse: bool = False) -> StreamUnpacker:
+        unpacker = StreamUnpacker(self.targetdir, name, sparse)
+        for chunk in split(data, [1000, 70000]):
+            unpacker.write(chunk)
+        unpacker.close()
+        return unpacker
+
+    def test_compressed_file(self) -> None:
+        data = make_data("dzzd")
+        unpacker = self.unpack(gzip.compress(data), "vmcore.gz", sparse=True)
+
+        self.assertEqual(unpacker.codecs, [CODEC_GZIP])
+        self.assertEqual(unpacker.files, [self.targetdir / "vmcore"])
+        self.assertEqual((self.targetdir / "vmcore").read_bytes(), data)
+
+    def test_tar(self) -> None:
+        data = make_data("dzzd")
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            for name in ["vmcore", "../escaped", "/absolute", "dir/../../escaped", "dir/vmcore-dmesg.txt"]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo("link")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "/etc/passwd"
+            tar.addfile(link)
+
+        unpacker = self.unpack(gzip.compress(stream.getvalue()), "vmcore.tar.gz")
+
+        self.assertEqual(unpacker.codecs, [CODEC_GZIP, CODEC_TAR])
+        self.assertEqual(unpacker.files, [self.targetdir / "vmcore", self.targetdir / "dir" / "vmcore-dmesg.txt"])
+        self.assertEqual(unpacker.skipped, ["../escaped", "/absolute", "dir/../../escaped", "link"])
+        self.assertEqual((self.targetdir / "vmcore").read_bytes(), data)
+        # nothing is written outside targetdir
+        self.assertEqual(sorted(path.name for path in Path(self.tmpdir.name).iterdir()), ["crash"])
+        self.assertFalse(Path("/absolute").exists())
+
+    def test_abort(self) -> None:
+        unpacker = StreamUnpacker(self.targetdir, "vmcore")
+        unpacker.write(os.urandom(10000))
+        unpacker.abort()
+
+        self.assertEqual(list(self.targetdir.iterdir()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
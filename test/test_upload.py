@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Tests of the checks retrace.retrace.extract_upload() makes on uploaded archives."""
+
+import io
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List, Optional
+
+from retrace.config import Config
+from retrace.retrace import UploadRejected, extract_upload
+from retrace.util import ARCHIVE_BZ2, ARCHIVE_GZ, ARCHIVE_TAR, ARCHIVE_XZ
+
+# plenty of space left on the target file system
+SPACE = 1 << 40
+
+WRITE_MODES = {
+    ARCHIVE_TAR: "w|",
+    ARCHIVE_GZ: "w|gz",
+    ARCHIVE_BZ2: "w|bz2",
+    ARCHIVE_XZ: "w|xz",
+}
+
+
+def member(name: str, size: int = 0, type_: bytes = tarfile.REGTYPE, linkname: str = "") -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.type = type_
+    info.linkname = linkname
+    return info
+
+
+def make_archive(files: List[tarfile.TarInfo], last: Optional[tarfile.TarInfo] = None) -> io.BytesIO:
+    """Returns a tar stream of files filled with "x". If last is given, the stream
+    ends with its header so that reading any of its data fails."""
+    stream = io.BytesIO()
+    # not a stream, the members are written to stream right away
+    tar = tarfile.open(fileobj=stream, mode="w")
+    for info in files:
+        tar.addfile(info, io.BytesIO(b"x" * info.size))
+    if last is not None:
+        stream.write(last.tobuf(tarfile.GNU_FORMAT))
+    else:
+        tar.close()
+
+    stream.seek(0)
+    return stream
+
+
+class TestExtractUpload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.config = Config()
+        cls.config.load()
+        cls.saved_config = dict(cls.config.GLOBAL)
+        cls.config.GLOBAL.update(MaxUnpackedSize=1, MinStorageLeft=1, SparseFiles=False)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.config.GLOBAL.update(cls.saved_config)
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.crashdir = Path(self.tmpdir.name)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def assertRejected(self, reason: int, last: tarfile.TarInfo, space: int = SPACE) -> None:
+        stream = make_archive([member("release", 10)], last)
+        with self.assertRaises(UploadRejected) as context:
+            extract_upload(stream, ARCHIVE_TAR, self.crashdir, space)
+
+        self.assertEqual(context.exception.reason, reason)
+        # the data of the offending file was never needed nor written
+        self.assertEqual([path.name for path in self.crashdir.iterdir()], ["release"])
+
+    def test_extract(self) -> None:
+        for archive_type, mode in WRITE_MODES.items():
+            with self.subTest(mode=mode), tempfile.TemporaryDirectory() as crashdir:
+                stream = io.BytesIO()
+                with tarfile.open(fileobj=stream, mode=mode) as tar:
+                    for name, data in [("./", b""), ("./coredump", b"core"), ("release", b"Fedora")]:
+                        info = member(name, len(data), tarfile.DIRTYPE if name.endswith("/") else tarfile.REGTYPE)
+                        tar.addfile(info, io.BytesIO(data))
+                stream.seek(0)
+
+                files = extract_upload(stream, archive_type, Path(crashdir), SPACE)
+
+                self.assertEqual([path.name for path in files], ["coredump", "release"])
+                self.assertEqual(Path(crashdir, "coredump").read_bytes(), b"core")
+
+    def test_symlink(self) -> None:
+        self.assertRejected(UploadRejected.SYMLINK, member("coredump", type_=tarfile.SYMTYPE, linkname="/etc/shadow"))
+
+    def test_hardlink(self) -> None:
+        self.assertRejected(UploadRejected.SYMLINK, member("coredump", type_=tarfile.LNKTYPE, linkname="release"))
+
+    def test_not_allowed(self) -> None:
+        for name in ["../coredump", "/coredump", "subdir/coredump", "bashrc"]:
+            with self.subTest(name=name):
+                self.assertRejected(UploadRejected.NOT_ALLOWED, member(name, 10))
+
+    def test_special_file(self) -> None:
+        self.assertRejected(UploadRejected.NOT_ALLOWED, member("coredump", type_=tarfile.FIFOTYPE))
+
+    def test_file_too_large(self) -> None:
+        self.assertRejected(UploadRejected.FILE_TOO_LARGE, member("package", 129))
+
+    def test_too_large(self) -> None:
+        self.assertRejected(UploadRejected.TOO_LARGE, member("coredump", 1 << 20))
+
+    def test_no_space(self) -> None:
+        self.assertRejected(UploadRejected.NO_SPACE, member("coredump", 100), space=(1 << 20) + 100)
+
+
+if __name__ == "__main__":
+    unittest.main()